@@ -1,7 +1,8 @@
-from flask import Flask
+from flask import Flask, send_from_directory
 from flask_restful import Api
 from dotenv import load_dotenv
 import os
+import threading
 import pymysql
 
 # Install PyMySQL as MySQLdb
@@ -47,7 +48,7 @@ from resources.users.address_resource import AddressListResource, AddressResourc
 from resources.product.category_resource import CategoryListResource, CategoryResource
 from resources.product.product_resource import ProductListResource, ProductResource
 from resources.product.product_image_resource import ProductImageListResource, ProductImageResource
-from resources.product.product_variant_resource import ProductVariantListResource, ProductVariantResource
+from resources.product.product_variant_resource import ProductVariantListResource, ProductVariantResource, ProductVariantAvailabilityResource
 from resources.product.products_complete import ( ProductCompleteListResource,
     ProductCompleteResource,
     ProductCreateCompleteResource,
@@ -57,10 +58,14 @@ from resources.product.products_complete import ( ProductCompleteListResource,
     ProductAddVariantsResource)
 from resources.cart.cart_resource import CartListResource, CartResource
 from resources.cart.cart_item_resource import CartItemListResource, CartItemResource
-from resources.cart.crat_per_user_with_items import CartResourceAdvanced
-from resources.cart.coupon_resource import CouponListResource, CouponResource
-from resources.orders.order_resource import OrderListResource, OrderResource
+from resources.cart.crat_per_user_with_items import CartResourceAdvanced, CartItemsAdvanced, CartOperationsAdvanced
+from resources.cart.guest_cart_resource import (GuestCartListResource, GuestCartResource, GuestCartItemsResource,
+    GuestCartOperationsResource)
+from resources.cart.coupon_resource import CouponListResource, CouponResource, CouponBulkResource, CouponValidateResource, CouponRedemptionListResource, CouponRedemptionResource
+from resources.orders.order_resource import (OrderListResource, OrderResource, UserOrderListResource,
+    OrderStatusBulkResource, OrderEventListResource)
 from resources.orders.order_item_resource import OrderItemListResource, OrderItemResource
+from resources.orders.checkout_resource import CheckoutResource
 from resources.promotion_resource import PromotionListResource, PromotionResource
 
 # Register API endpoints
@@ -78,12 +83,14 @@ api.add_resource(CategoryListResource, '/api/categories')
 api.add_resource(CategoryResource, '/api/categories/<int:id>')
 
 # Products
-api.add_resource(ProductListResource, '/api/products')
-api.add_resource(ProductResource, '/api/products/<int:id>')
-
+# The complete resources are registered first so they serve GET; the plain
+# resources still handle POST, PATCH and DELETE on the same URLs
 #from product_complete import resources
 api.add_resource(ProductCompleteListResource, '/api/products')
 api.add_resource(ProductCompleteResource, '/api/products/<int:product_id>')
+api.add_resource(ProductListResource, '/api/products')
+api.add_resource(ProductResource, '/api/products/<int:id>')
+
 api.add_resource(ProductCreateCompleteResource, '/api/products/create')
 api.add_resource(ProductUpdateResource, '/api/products/<int:product_id>/update')
 api.add_resource(ProductUploadImagesResource, '/api/products/<int:product_id>/images')
@@ -96,6 +103,7 @@ api.add_resource(ProductImageResource, '/api/product-images/<int:id>')
 
 # Product Variants
 api.add_resource(ProductVariantListResource, '/api/product-variants')
+api.add_resource(ProductVariantAvailabilityResource, '/api/product-variants/availability')
 api.add_resource(ProductVariantResource, '/api/product-variants/<int:id>')
 
 # Carts
@@ -103,6 +111,14 @@ api.add_resource(CartListResource, '/api/carts')
 api.add_resource(CartResource, '/api/carts/<int:id>')
 
 api.add_resource(CartResourceAdvanced, '/api/user/<int:user_id>/carts')
+api.add_resource(CartItemsAdvanced, '/api/user/<int:user_id>/carts/items')
+api.add_resource(CartOperationsAdvanced, '/api/user/<int:user_id>/carts/operations')
+
+# Guest carts
+api.add_resource(GuestCartListResource, '/api/guest-carts')
+api.add_resource(GuestCartResource, '/api/guest-carts/<string:guest_token>')
+api.add_resource(GuestCartItemsResource, '/api/guest-carts/<string:guest_token>/items')
+api.add_resource(GuestCartOperationsResource, '/api/guest-carts/<string:guest_token>/operations')
 
 # Cart Items
 api.add_resource(CartItemListResource, '/api/cart-items')
@@ -111,15 +127,25 @@ api.add_resource(CartItemResource, '/api/cart-items/<int:id>')
 # Coupons
 api.add_resource(CouponListResource, '/api/coupons')
 api.add_resource(CouponResource, '/api/coupons/<int:id>')
+api.add_resource(CouponValidateResource, '/api/coupons/validate')
+api.add_resource(CouponBulkResource, '/api/coupons/bulk')
+api.add_resource(CouponRedemptionListResource, '/api/coupons/<int:id>/redemptions')
+api.add_resource(CouponRedemptionResource, '/api/coupon-redemptions/<int:id>')
 
 # Orders
 api.add_resource(OrderListResource, '/api/orders')
 api.add_resource(OrderResource, '/api/orders/<int:id>')
+api.add_resource(OrderStatusBulkResource, '/api/orders/status')
+api.add_resource(OrderEventListResource, '/api/orders/<int:id>/events')
+api.add_resource(UserOrderListResource, '/api/user/<int:user_id>/orders')
 
 # Order Items
 api.add_resource(OrderItemListResource, '/api/order-items')
 api.add_resource(OrderItemResource, '/api/order-items/<int:id>')
 
+# Checkout
+api.add_resource(CheckoutResource, '/api/user/<int:user_id>/checkout')
+
 # Promotions
 api.add_resource(PromotionListResource, '/api/promotions')
 api.add_resource(PromotionResource, '/api/promotions/<int:id>')
@@ -128,9 +154,116 @@ api.add_resource(PromotionResource, '/api/promotions/<int:id>')
 def home():
     return '<h1>Welcome to E-commerce API</h1><p>Visit /api/* endpoints for API access</p>'
 
+# Serve images when they are stored on the local filesystem (development)
+if os.getenv('STORAGE_BACKEND', 'b2').lower() == 'local':
+    @app.route('/media/<path:file_name>')
+    def media(file_name):
+        from utils.storage import get_storage
+        return send_from_directory(get_storage().root, file_name)
+
+# Storage objects orphaned by deletes are removed in the background. Set
+# STORAGE_DELETION_WORKER=0 to run `flask drain-storage-deletions` from cron instead
+from utils.storage_deletions import drain_storage_deletions
+
+@app.cli.command('drain-storage-deletions')
+def drain_storage_deletions_command():
+    """Delete all due storage objects from the deletion outbox"""
+    total = 0
+    while True:
+        processed = drain_storage_deletions()
+        if not processed:
+            break
+        total += processed
+    print(f"Processed {total} pending storage deletions")
+
+# Carts untouched for CART_TTL_DAYS are deleted in the background; without
+# it carts never expire. `flask sweep-carts` runs a full sweep on demand
+from utils.cart_sweeper import cart_ttl_days, sweep_abandoned_carts
+
+@app.cli.command('sweep-carts')
+def sweep_carts_command():
+    """Delete carts that have not changed for CART_TTL_DAYS"""
+    if cart_ttl_days() is None:
+        print("CART_TTL_DAYS is not set, carts never expire")
+        return
+    print(f"Deleted {sweep_abandoned_carts()} abandoned carts")
+
+# Thumbnail, card and detail images are generated in the background after
+# upload; this command generates them for images stored before that
+@app.cli.command('generate-derivatives')
+def generate_derivatives_command():
+    """Generate missing image derivatives for all stored images"""
+    from utils.derivatives import backfill_derivatives, derivatives_enabled
+    if not derivatives_enabled():
+        print("Image derivatives are disabled (Pillow missing or IMAGE_DERIVATIVES=0)")
+        return
+    print(f"Generated derivatives for {backfill_derivatives()} images")
+
+# Stock held at checkout is given back, and the unpaid order cancelled, once
+# the hold expires; INVENTORY_HOLD_WORKER=0 to run `flask expire-holds` from cron
+from utils.inventory import expire_holds
+
+@app.cli.command('expire-holds')
+def expire_holds_command():
+    """Release expired inventory holds and cancel their unpaid orders"""
+    print(f"Released {expire_holds()} expired inventory holds")
+
+# Coupons are looked up by code_key; this command fills it in for coupons
+# created before the column existed
+@app.cli.command('backfill-coupon-keys')
+def backfill_coupon_keys_command():
+    """Set code_key on coupons that have none"""
+    from sqlalchemy import update
+    from models.coupon import Coupon, coupon_code_key
+    total = 0
+    while True:
+        rows = db.session.query(Coupon.id, Coupon.code).filter(Coupon.code_key.is_(None)).limit(1000).all()
+        if not rows:
+            break
+        db.session.execute(update(Coupon), [{'id': id, 'code_key': coupon_code_key(code)} for id, code in rows])
+        db.session.commit()
+        total += len(rows)
+    print(f"Set code_key on {total} coupons")
+
+def start_background_workers():
+    """
+    Start the background workers enabled by the environment on this process.
+
+    Called by the server entrypoint below and by `flask run-workers`, never on
+    import, so CLI commands, tests and WSGI workers start no threads.
+    """
+    from utils.storage_deletions import start_storage_deletion_worker
+    from utils.cart_sweeper import start_cart_sweeper
+    from utils.inventory import start_hold_expiry_worker
+    from utils.idempotency import start_idempotency_key_purger
+
+    workers = []
+    if os.getenv('STORAGE_DELETION_WORKER', '1') == '1':
+        workers.append(start_storage_deletion_worker(app))
+    if cart_ttl_days() is not None and os.getenv('CART_SWEEPER', '1') == '1':
+        workers.append(start_cart_sweeper(app))
+    if os.getenv('INVENTORY_HOLD_WORKER', '1') == '1':
+        workers.append(start_hold_expiry_worker(app))
+    # Responses stored for Idempotency-Key retries are deleted once expired
+    if os.getenv('IDEMPOTENCY_KEY_PURGER', '1') == '1':
+        workers.append(start_idempotency_key_purger(app))
+    return workers
+
+# When the app is served by gunicorn, run the workers as their own process
+@app.cli.command('run-workers')
+def run_workers_command():
+    """Run the enabled background workers until interrupted"""
+    workers = start_background_workers()
+    print(f"Started {len(workers)} background workers: {', '.join(worker.name for worker in workers)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+
 if __name__ == '__main__':
     print(f"Connecting to: {DB_HOST}:{DB_PORT}/{DB_NAME}")
-    print("Initializing Backblaze B2 Storage...")
+    print("Initializing storage...")
 
     
     with app.app_context():
@@ -143,18 +276,25 @@ if __name__ == '__main__':
             db.create_all()
             print("✓ Database tables ready!")
 
+            from utils.promotion_index import get_promotion_index
+            get_promotion_index().build()
+            print("✓ Promotion index built")
+
             try:
-                from utils.b2_storage import get_b2_storage
-                storage =  get_b2_storage()
-                print("✓ Backblaze B2 storage initialized!")
-                print(f" Bucket: {storage.bucket_name}")
+                from utils.storage import get_storage
+                storage = get_storage()
+                # B2 authorizes on first upload, not here
+                print(f"✓ Storage backend ready: {storage.name}")
+                if storage.name == 'b2':
+                    print(f" Bucket: {storage.bucket_name}")
             except Exception as e:
-                print(f"⚠ Warning: B2 Storage initialization failed: {e}")
+                print(f"⚠ Warning: Storage initialization failed: {e}")
                 print("  Products will work but image upload will fail")
             
         except Exception as e:
             print(f"✗ Database error: {e}")
             exit(1)
             
+    start_background_workers()
     print("\n🚀 Server starting on http://localhost:5000")
     app.run()
\ No newline at end of file
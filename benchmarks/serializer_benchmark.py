@@ -0,0 +1,95 @@
+"""
+Compare flask_restful marshal with the compiled serializers on a synthetic
+10k-product catalog and a large cart.
+
+Run from the repository root:
+    python -m benchmarks.serializer_benchmark [product_count]
+
+The script checks that both paths produce byte-identical JSON before timing them.
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+from flask_restful import marshal
+
+from resources.product.products_complete import product_complete_fields
+from resources.cart.crat_per_user_with_items import cart_detail_fields
+from utils.serializer import compile_fields
+
+
+def build_catalog(count):
+    base = datetime(2024, 1, 1, 8, 30)
+    categories = [
+        SimpleNamespace(id=i, name=f"Category {i}", description=None if i % 3 else f"About {i}")
+        for i in range(1, 21)
+    ]
+    products = []
+    for i in range(1, count + 1):
+        images = [
+            SimpleNamespace(id=i * 10 + n, product_id=i, image_path=f"products/{i}_{n}.jpg",
+                            alt_text=None if n else f"Product {i}", is_primary=1 if n == 0 else 0)
+            for n in range(3)
+        ]
+        variants = [
+            SimpleNamespace(id=i * 10 + n, product_id=i, variant_name=f"{250 * (n + 1)} gm",
+                            variant_price=Decimal(f"{i % 500}.{n}9"), stock_quantity=None if n == 2 else i % 40,
+                            quantity_unit='gm')
+            for n in range(3)
+        ]
+        products.append(SimpleNamespace(
+            id=i, name=f"Product {i}", description=f"Fresh produce #{i}",
+            category_id=categories[i % 20].id, is_active=i % 2, created_at=base + timedelta(minutes=i),
+            updated_at=None if i % 7 == 0 else base + timedelta(hours=i), stock_quantity=i % 100,
+            stock_unit='Kg', category=categories[i % 20], images=images, variants=variants,
+        ))
+    return products
+
+
+def build_cart(item_count):
+    user = SimpleNamespace(id=1, First_name='Asha', Last_name='Rao', email='asha@example.com')
+    items = []
+    for i in range(1, item_count + 1):
+        product = SimpleNamespace(id=i, name=f"Product {i}", description=None)
+        variant = SimpleNamespace(id=i, variant_name='1 Kg', variant_price=Decimal('49.50'), product=product)
+        items.append(SimpleNamespace(
+            id=i, cart_id=1, product_variant_id=i, quantity=i % 5 + 1, product_actual_price=Decimal('50'),
+            applicable_promotion_id=None, promotion_discount=Decimal('0.50'), After_discounted_total=Decimal('49'),
+            updated_at=datetime(2024, 3, 1, 12, 0), product_variant=variant,
+        ))
+    return SimpleNamespace(
+        id=1, user_id=1, coupon_active=0, coupon_id=None, coupon_code=None, coupon_discount=Decimal('0.00'),
+        dicounted_total_price=Decimal('100'), actual_amount=Decimal('120'), updated_at=datetime(2024, 3, 1),
+        cart_items=items, user=user,
+    )
+
+
+def timed(label, fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<10} {best * 1000:9.1f} ms")
+    return best, result
+
+
+def compare(name, objects, field_dict):
+    serialize = compile_fields(field_dict)
+    print(f"{name} ({len(objects)} objects)")
+    marshal_time, expected = timed('marshal', lambda: [marshal(obj, field_dict) for obj in objects])
+    compiled_time, actual = timed('compiled', lambda: [serialize(obj) for obj in objects])
+
+    if json.dumps(expected) != json.dumps(actual):
+        raise SystemExit(f"{name}: compiled output differs from marshal")
+    print(f"  identical output, {marshal_time / compiled_time:.1f}x faster")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    compare('products', build_catalog(count), product_complete_fields)
+    compare('carts', [build_cart(200) for _ in range(50)], cart_detail_fields)
@@ -13,9 +13,17 @@ from models.order_item import OrderItem
 from models.promotion import Promotion
 from models.promotion_product import PromotionProduct
 from models.promotion_category import PromotionCategory
+from models.stored_image import StoredImage
+from models.storage_deletion import StorageDeletion
+from models.image_derivative import ImageDerivative
+from models.inventory_hold import InventoryHold
+from models.idempotency_key import IdempotencyKey
+from models.order_event import OrderEvent
 
 __all__ = [
     'User', 'Address', 'Category', 'Product', 'ProductImage',
     'ProductVariant', 'Cart', 'CartItem', 'Coupon', 'CouponUser',
-    'Order', 'OrderItem', 'Promotion', 'PromotionProduct', 'PromotionCategory'
+    'Order', 'OrderItem', 'Promotion', 'PromotionProduct', 'PromotionCategory',
+    'StoredImage', 'StorageDeletion', 'ImageDerivative', 'InventoryHold',
+    'IdempotencyKey', 'OrderEvent'
 ]
\ No newline at end of file
@@ -3,16 +3,27 @@ from datetime import datetime
 
 class Cart(db.Model):
     __tablename__ = 'Carts'
+    __table_args__ = (
+        # The abandoned-cart sweeper walks carts oldest first
+        db.Index('ix_carts_updated_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=False)
+    # One cart per user, so a cart can be created on first add without races;
+    # guest carts have no user and are found by their opaque token instead
+    user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=True, unique=True)
+    guest_token = db.Column(db.String(64), nullable=True, unique=True)
     coupon_active = db.Column(db.Integer, default=0)
     coupon_id = db.Column(db.Integer, db.ForeignKey('Coupons.id'), nullable=True)
     coupon_code = db.Column(db.Text, nullable=True)
     coupon_discount = db.Column(db.DECIMAL(10, 2), default=0)
-    dicounted_total_price = db.Column(db.DECIMAL(10, 0), default=0)
-    actual_amount = db.Column(db.DECIMAL(10, 0), default=0)
+    # Totals are computed by utils.pricing as currency amounts rounded to two
+    # decimal places, like the DECIMAL(10, 2) variant prices
+    dicounted_total_price = db.Column(db.DECIMAL(10, 2), default=0)
+    actual_amount = db.Column(db.DECIMAL(10, 2), default=0)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped on every change to the cart or its items; served as the ETag
+    version = db.Column(db.Integer, nullable=False, default=0)
     
     # Relationships
     coupon = db.relationship('Coupon', backref='carts', foreign_keys=[coupon_id])
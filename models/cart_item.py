@@ -3,15 +3,21 @@ from datetime import datetime
 
 class CartItem(db.Model):
     __tablename__ = 'Carts_items'
+    __table_args__ = (
+        # One line per variant; adding again increments the quantity
+        db.UniqueConstraint('cart_id', 'product_variant_id', name='uq_cart_items_cart_variant'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     cart_id = db.Column(db.Integer, db.ForeignKey('Carts.id'), nullable=False)
     product_variant_id = db.Column(db.Integer, db.ForeignKey('Product_Variants.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
-    product_actual_price = db.Column(db.DECIMAL(10, 0), nullable=False)
+    # Unit price and totals are computed by utils.pricing as currency amounts
+    # rounded to two decimal places, like the DECIMAL(10, 2) variant prices
+    product_actual_price = db.Column(db.DECIMAL(10, 2), nullable=False)
     applicable_promotion_id = db.Column(db.Integer, db.ForeignKey('Promotions.id'), nullable=True)
     promotion_discount = db.Column(db.DECIMAL(10, 2), default=0)
-    After_discounted_total = db.Column(db.DECIMAL(10, 0), default=0)
+    After_discounted_total = db.Column(db.DECIMAL(10, 2), default=0)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
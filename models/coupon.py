@@ -1,19 +1,36 @@
+import hashlib
 from extensions import db
 from datetime import datetime
+from sqlalchemy.orm import validates
+
+
+def coupon_code_key(code):
+    """Fixed-length lookup key of a coupon code: sha256 of the trimmed, upper-cased code"""
+    return hashlib.sha256((code or '').strip().upper().encode('utf-8')).hexdigest()
+
 
 class Coupon(db.Model):
     __tablename__ = 'Coupons'
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     code = db.Column(db.Text, nullable=False, unique=True)
+    # Indexed stand-in for code, which is too long to index; set with code
+    code_key = db.Column(db.String(64), nullable=True, unique=True)
     discount_type = db.Column(db.String(10), nullable=False)
     discount_values = db.Column(db.Integer, nullable=False)
     min_order_value = db.Column(db.Integer, default=0)
     usage_limit = db.Column(db.Integer, nullable=True)
     used_count = db.Column(db.Integer, default=0)
+    # Uses allowed per user, unlimited when null
+    per_user_limit = db.Column(db.Integer, nullable=True)
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
     is_active = db.Column(db.Integer, default=1)
     
     # Relationships
     coupon_users = db.relationship('CouponUser', backref='coupon', lazy='dynamic', foreign_keys='CouponUser.coupon_id')
+
+    @validates('code')
+    def _set_code_key(self, key, code):
+        self.code_key = coupon_code_key(code)
+        return code
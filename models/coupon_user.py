@@ -1,8 +1,12 @@
 from extensions import db
+from datetime import datetime
 
 class CouponUser(db.Model):
     __tablename__ = 'Coupon_Code_Users'
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     coupon_id = db.Column(db.Integer, db.ForeignKey('Coupons.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=False)
+    # Order the use was redeemed for; released when the order is cancelled
+    order_id = db.Column(db.Integer, db.ForeignKey('Orders.id'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
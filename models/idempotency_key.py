@@ -0,0 +1,25 @@
+from extensions import db
+from datetime import datetime
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'Idempotency_Keys'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'key', name='uq_idempotency_keys_scope_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Method and path the key was used on, and the key the client sent
+    scope = db.Column(db.String(255), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    # sha256 of the request body, to refuse a key reused for another request
+    request_hash = db.Column(db.String(64), nullable=False)
+    # Null while the first request is still running
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text(16777215), nullable=True)
+    response_headers = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # When the running request claimed the key; a stale claim can be taken over
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    # Set in the handler's transaction once it commits; the key is then never taken over
+    committed_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
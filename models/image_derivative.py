@@ -0,0 +1,19 @@
+from extensions import db
+from datetime import datetime
+
+class ImageDerivative(db.Model):
+    """Resized copy of stored image content, shared by every image with that content"""
+    __tablename__ = 'Image_Derivatives'
+    __table_args__ = (
+        db.UniqueConstraint('content_hash', 'name', 'format', name='uq_image_derivatives_hash_name_format'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    name = db.Column(db.String(20), nullable=False)
+    format = db.Column(db.String(10), nullable=False)
+    file_path = db.Column(db.String(255), nullable=False, index=True)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
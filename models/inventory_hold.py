@@ -0,0 +1,13 @@
+from extensions import db
+from datetime import datetime
+
+class InventoryHold(db.Model):
+    __tablename__ = 'Inventory_Holds'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('Orders.id'), nullable=False, index=True)
+    product_variant_id = db.Column(db.Integer, db.ForeignKey('Product_Variants.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    # Reserved stock is given back after this unless the order is paid
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
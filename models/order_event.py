@@ -0,0 +1,15 @@
+from extensions import db
+from datetime import datetime
+
+class OrderEvent(db.Model):
+    __tablename__ = 'Order_Events'
+    
+    # Append-only; rows are never deleted, and only order_id changes, to NULL
+    # when the order itself is deleted
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('Orders.id'), nullable=True, index=True)
+    from_status = db.Column(db.String(20), nullable=True)
+    to_status = db.Column(db.String(20), nullable=False)
+    # What made the change: api, bulk or hold_expired
+    source = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
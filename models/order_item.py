@@ -8,4 +8,4 @@ class OrderItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('Products.id'), nullable=False)
     product_variant_id = db.Column(db.Integer, db.ForeignKey('Product_Variants.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    price = db.Column(db.DECIMAL(10, 0), nullable=False)
\ No newline at end of file
+    price = db.Column(db.DECIMAL(10, 2), nullable=False)
\ No newline at end of file
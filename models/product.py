@@ -3,6 +3,12 @@ from datetime import datetime
 
 class Product(db.Model):
     __tablename__ = 'Products'
+    __table_args__ = (
+        # Keyset pagination and storefront filters on the complete listing
+        db.Index('ix_products_category_active_id', 'category_id', 'is_active', 'id'),
+        db.Index('ix_products_active_updated_id', 'is_active', 'updated_at', 'id'),
+        db.Index('ix_products_updated_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(250), nullable=False)
@@ -7,4 +7,6 @@ class ProductImage(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('Products.id'), nullable=False)
     image_path = db.Column(db.Text, nullable=False)
     alt_text = db.Column(db.Text, nullable=True)
-    is_primary = db.Column(db.Integer, default=0)
\ No newline at end of file
+    is_primary = db.Column(db.Integer, default=0)
+    # SHA-256 of the stored object, links the row to Stored_Images
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
\ No newline at end of file
@@ -2,12 +2,19 @@ from extensions import db
 
 class ProductVariant(db.Model):
     __tablename__ = 'Product_Variants'
+    __table_args__ = (
+        # Price range and in-stock filters run as EXISTS probes per product
+        db.Index('ix_variants_product_price', 'product_id', 'variant_price'),
+        db.Index('ix_variants_product_stock', 'product_id', 'stock_quantity'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     product_id = db.Column(db.Integer, db.ForeignKey('Products.id'), nullable=False)
     variant_name = db.Column(db.Text, nullable=False)
     variant_price = db.Column(db.DECIMAL(10, 2), nullable=False)
     stock_quantity = db.Column(db.Integer, default=0)
+    # Units held for unpaid orders; available stock is stock_quantity - reserved_quantity
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     quantity_unit = db.Column(db.String(55), nullable=True)
     
     # Relationships
@@ -0,0 +1,13 @@
+from extensions import db
+from datetime import datetime
+
+class StorageDeletion(db.Model):
+    """Outbox of storage objects to delete, written with the row delete"""
+    __tablename__ = 'Storage_Deletions'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    file_name = db.Column(db.String(255), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
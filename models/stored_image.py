@@ -0,0 +1,13 @@
+from extensions import db
+from datetime import datetime
+
+class StoredImage(db.Model):
+    __tablename__ = 'Stored_Images'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)
+    file_path = db.Column(db.String(255), nullable=False, index=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    size = db.Column(db.Integer, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
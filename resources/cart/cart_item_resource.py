@@ -1,6 +1,12 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields, marshal_with, abort
+from models.cart import Cart
 from models.cart_item import CartItem
 from extensions import db
+from utils.idempotency import idempotent
+from utils.pricing import price_cart
+from utils.cart_ops import add_cart_item
+from resources.cart.crat_per_user_with_items import (expected_cart_version, claim_cart_version, commit_cart,
+    parse_cart_item_add)
 
 cart_item_fields = {
     'id': fields.Integer,
@@ -14,14 +20,12 @@ cart_item_fields = {
     'updated_at': fields.DateTime
 }
 
+# Prices, promotions and totals are computed by the pricing engine; values
+# posted for them are ignored
 cart_item_parser = reqparse.RequestParser()
 cart_item_parser.add_argument('cart_id', type=int, required=True)
 cart_item_parser.add_argument('product_variant_id', type=int, required=True)
 cart_item_parser.add_argument('quantity', type=int, required=True)
-cart_item_parser.add_argument('product_actual_price', type=float, required=True)
-cart_item_parser.add_argument('applicable_promotion_id', type=int)
-cart_item_parser.add_argument('promotion_discount', type=float)
-cart_item_parser.add_argument('After_discounted_total', type=float)
 
 class CartItemListResource(Resource):
     @marshal_with(cart_item_fields)
@@ -29,13 +33,19 @@ class CartItemListResource(Resource):
         items = CartItem.query.all()
         return items
     
+    @idempotent
     @marshal_with(cart_item_fields)
     def post(self):
         args = cart_item_parser.parse_args()
-        item = CartItem(**args)
-        db.session.add(item)
-        db.session.commit()
-        return item, 201
+        cart = Cart.query.get_or_404(args['cart_id'])
+        expected_version = expected_cart_version(cart)
+        variant, quantity = parse_cart_item_add()
+        # Adding a variant that is already in the cart increments its line
+        add_cart_item(cart.id, variant.id, quantity, variant.variant_price)
+        item = CartItem.query.filter_by(cart_id=cart.id, product_variant_id=variant.id).first()
+        price_cart(cart)
+        etag = commit_cart(cart, expected_version)
+        return item, 201, {'ETag': etag}
 
 class CartItemResource(Resource):
     @marshal_with(cart_item_fields)
@@ -46,15 +56,28 @@ class CartItemResource(Resource):
     @marshal_with(cart_item_fields)
     def patch(self, id):
         args = cart_item_parser.parse_args()
+        if args['quantity'] < 1:
+            abort(400, message="quantity must be at least 1")
         item = CartItem.query.get_or_404(id)
+        # If-Match carries the ETag of the item's cart
+        cart = Cart.query.get(item.cart_id)
+        expected_version = expected_cart_version(cart)
         for key, value in args.items():
             if value is not None:
                 setattr(item, key, value)
-        db.session.commit()
-        return item
+        price_cart(cart)
+        if item.cart_id != cart.id:
+            target = Cart.query.get_or_404(item.cart_id)
+            price_cart(target)
+            claim_cart_version(target)
+        etag = commit_cart(cart, expected_version)
+        return item, 200, {'ETag': etag}
     
     def delete(self, id):
         item = CartItem.query.get_or_404(id)
+        cart = Cart.query.get(item.cart_id)
+        expected_version = expected_cart_version(cart)
         db.session.delete(item)
-        db.session.commit()
-        return {'message': 'Cart item deleted'}, 204
+        price_cart(cart)
+        etag = commit_cart(cart, expected_version)
+        return {'message': 'Cart item deleted'}, 204, {'ETag': etag}
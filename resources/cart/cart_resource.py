@@ -1,6 +1,11 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields, marshal_with, abort
+from sqlalchemy.exc import IntegrityError
 from models.cart import Cart
+from models.user import User
 from extensions import db
+from utils.pricing import price_cart
+from utils.cart_ops import cart_etag
+from resources.cart.crat_per_user_with_items import expected_cart_version, commit_cart
 
 cart_fields = {
     'id': fields.Integer,
@@ -11,17 +16,16 @@ cart_fields = {
     'coupon_discount': fields.Float,
     'dicounted_total_price': fields.Float,
     'actual_amount': fields.Float,
-    'updated_at': fields.DateTime
+    'updated_at': fields.DateTime,
+    'version': fields.Integer
 }
 
+# Discounts and totals are computed by the pricing engine
 cart_parser = reqparse.RequestParser()
 cart_parser.add_argument('user_id', type=int, required=True)
 cart_parser.add_argument('coupon_active', type=int, choices=[0, 1])
 cart_parser.add_argument('coupon_id', type=int)
 cart_parser.add_argument('coupon_code', type=str)
-cart_parser.add_argument('coupon_discount', type=float)
-cart_parser.add_argument('dicounted_total_price', type=float)
-cart_parser.add_argument('actual_amount', type=float)
 
 class CartListResource(Resource):
     @marshal_with(cart_fields)
@@ -32,26 +36,38 @@ class CartListResource(Resource):
     @marshal_with(cart_fields)
     def post(self):
         args = cart_parser.parse_args()
+        if not User.query.get(args['user_id']):
+            abort(404, message=f"User with id {args['user_id']} not found")
+        if Cart.query.filter_by(user_id=args['user_id']).first():
+            abort(400, message=f"Cart already exists for user_id {args['user_id']}")
         cart = Cart(**args)
         db.session.add(cart)
-        db.session.commit()
+        price_cart(cart)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request created the user's cart first
+            db.session.rollback()
+            abort(400, message=f"Cart already exists for user_id {args['user_id']}")
         return cart, 201
 
 class CartResource(Resource):
     @marshal_with(cart_fields)
     def get(self, id):
         cart = Cart.query.get_or_404(id)
-        return cart
+        return cart, 200, {'ETag': cart_etag(cart.version)}
     
     @marshal_with(cart_fields)
     def patch(self, id):
         args = cart_parser.parse_args()
         cart = Cart.query.get_or_404(id)
+        expected_version = expected_cart_version(cart)
         for key, value in args.items():
             if value is not None:
                 setattr(cart, key, value)
-        db.session.commit()
-        return cart
+        price_cart(cart)
+        etag = commit_cart(cart, expected_version)
+        return cart, 200, {'ETag': etag}
     
     def delete(self, id):
         cart = Cart.query.get_or_404(id)
@@ -1,7 +1,16 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+import json
+from flask import Response, stream_with_context
+from flask_restful import Resource, reqparse, fields, marshal_with, marshal, abort
 from models.coupon import Coupon
+from models.user import User
+from models.order import Order
 from extensions import db
+from utils.idempotency import idempotent
 from datetime import datetime
+from utils.coupon_ops import claim_coupon, release_coupon, CouponUnavailable
+from utils.coupon_cache import get_coupon_cache
+from utils.coupon_codes import generate_coupons, code_space_fits, BULK_COUPON_MAX
+from utils.pricing import to_decimal, discount_amount
 
 coupon_fields = {
     'id': fields.Integer,
@@ -11,9 +20,18 @@ coupon_fields = {
     'min_order_value': fields.Integer,
     'usage_limit': fields.Integer,
     'used_count': fields.Integer,
+    'per_user_limit': fields.Integer,
     'start_date': fields.DateTime,
     'end_date': fields.DateTime,
-    'is_ative': fields.Integer
+    'is_active': fields.Integer
+}
+
+coupon_redemption_fields = {
+    'id': fields.Integer,
+    'coupon_id': fields.Integer,
+    'user_id': fields.Integer,
+    'order_id': fields.Integer,
+    'created_at': fields.DateTime
 }
 
 coupon_parser = reqparse.RequestParser()
@@ -22,9 +40,34 @@ coupon_parser.add_argument('discount_type', type=str, required=True)
 coupon_parser.add_argument('discount_values', type=int, required=True)
 coupon_parser.add_argument('min_order_value', type=int)
 coupon_parser.add_argument('usage_limit', type=int)
+coupon_parser.add_argument('per_user_limit', type=int)
 coupon_parser.add_argument('start_date', type=str, required=True)
 coupon_parser.add_argument('end_date', type=str, required=True)
-coupon_parser.add_argument('is_ative', type=int, choices=[0, 1])
+coupon_parser.add_argument('is_active', type=int, choices=[0, 1])
+
+# Parser for bulk generation; every coupon gets a random code and these values
+coupon_bulk_parser = reqparse.RequestParser()
+coupon_bulk_parser.add_argument('count', type=int, required=True)
+coupon_bulk_parser.add_argument('length', type=int, default=10)
+coupon_bulk_parser.add_argument('prefix', type=str, default='')
+coupon_bulk_parser.add_argument('format', type=str, choices=['csv', 'ndjson'], default='csv')
+coupon_bulk_parser.add_argument('discount_type', type=str, required=True)
+coupon_bulk_parser.add_argument('discount_values', type=int, required=True)
+coupon_bulk_parser.add_argument('min_order_value', type=int, default=0)
+coupon_bulk_parser.add_argument('usage_limit', type=int, default=1)
+coupon_bulk_parser.add_argument('per_user_limit', type=int)
+coupon_bulk_parser.add_argument('start_date', type=str, required=True)
+coupon_bulk_parser.add_argument('end_date', type=str, required=True)
+coupon_bulk_parser.add_argument('is_active', type=int, choices=[0, 1], default=1)
+
+coupon_validate_parser = reqparse.RequestParser()
+coupon_validate_parser.add_argument('code', type=str, required=True, location='args')
+coupon_validate_parser.add_argument('user_id', type=int, location='args')
+coupon_validate_parser.add_argument('order_value', type=str, location='args')
+
+coupon_redemption_parser = reqparse.RequestParser()
+coupon_redemption_parser.add_argument('user_id', type=int, required=True)
+coupon_redemption_parser.add_argument('order_id', type=int)
 
 class CouponListResource(Resource):
     @marshal_with(coupon_fields)
@@ -40,8 +83,55 @@ class CouponListResource(Resource):
         coupon = Coupon(**args)
         db.session.add(coupon)
         db.session.commit()
+        get_coupon_cache().clear()
         return coupon, 201
 
+class CouponBulkResource(Resource):
+    def post(self):
+        """
+        Generate `count` coupons with random codes and stream the codes back
+
+        The coupons share the given discount, window and limits (single use
+        by default). Codes are `length` symbols after an optional prefix, and
+        are written in batches of multi-row inserts, each committed before
+        its codes are streamed, as CSV with a `code` header or as NDJSON.
+        A listing cut short means generation stopped; the codes listed exist.
+        """
+        args = coupon_bulk_parser.parse_args()
+        if not 1 <= args['count'] <= BULK_COUPON_MAX:
+            abort(400, message=f"count must be between 1 and {BULK_COUPON_MAX}")
+        if not 6 <= args['length'] <= 32:
+            abort(400, message="length must be between 6 and 32")
+        prefix = args['prefix'] or ''
+        if len(prefix) > 16 or not all(ch.isascii() and (ch.isalnum() or ch == '-') for ch in prefix):
+            abort(400, message="prefix must be at most 16 letters, digits or dashes")
+        if not code_space_fits(args['count'], args['length']):
+            abort(400, message=f"length {args['length']} is too short for {args['count']} codes")
+        template = {
+            'discount_type': args['discount_type'],
+            'discount_values': args['discount_values'],
+            'min_order_value': args['min_order_value'],
+            'usage_limit': args['usage_limit'],
+            'per_user_limit': args['per_user_limit'],
+            'start_date': datetime.fromisoformat(args['start_date']),
+            'end_date': datetime.fromisoformat(args['end_date']),
+            'is_active': args['is_active']
+        }
+        batches = generate_coupons(args['count'], template, args['length'], prefix)
+        
+        def stream():
+            if args['format'] == 'csv':
+                yield 'code\n'
+            for codes in batches:
+                if args['format'] == 'csv':
+                    yield ''.join(f"{code}\n" for code in codes)
+                else:
+                    yield ''.join(json.dumps({'code': code}) + '\n' for code in codes)
+            get_coupon_cache().clear()
+        
+        mimetype = 'text/csv' if args['format'] == 'csv' else 'application/x-ndjson'
+        return Response(stream_with_context(stream()), status=201, mimetype=mimetype)
+
 class CouponResource(Resource):
     @marshal_with(coupon_fields)
     def get(self, id):
@@ -60,10 +150,79 @@ class CouponResource(Resource):
             if value is not None:
                 setattr(coupon, key, value)
         db.session.commit()
+        get_coupon_cache().clear()
         return coupon
     
     def delete(self, id):
         coupon = Coupon.query.get_or_404(id)
         db.session.delete(coupon)
         db.session.commit()
+        get_coupon_cache().clear()
         return {'message': 'Coupon deleted'}, 204
+
+class CouponValidateResource(Resource):
+    def get(self):
+        """
+        Check whether a coupon code can be used, without redeeming it
+
+        Query params: code, and optionally user_id (checks per_user_limit)
+        and order_value (checks min_order_value and returns the discount).
+        Codes are matched ignoring case and surrounding spaces. Answers
+        {"valid": false, "reason": ...} for unusable or unknown codes.
+        """
+        args = coupon_validate_parser.parse_args()
+        order_value = None
+        if args['order_value'] is not None:
+            try:
+                order_value = to_decimal(args['order_value'])
+            except ArithmeticError:
+                abort(400, message="order_value must be a number")
+        
+        coupon = get_coupon_cache().lookup(args['code'], args['user_id'])
+        if coupon is None:
+            return {'valid': False, 'reason': 'not_found'}, 200
+        
+        reason = coupon.rejection(order_value, datetime.utcnow())
+        response = {
+            'valid': reason is None,
+            'reason': reason,
+            'coupon': marshal(coupon, coupon_fields)
+        }
+        if reason is None and order_value is not None:
+            response['discount'] = float(discount_amount(coupon.discount_type, coupon.discount_values, order_value))
+        return response, 200
+
+
+class CouponRedemptionListResource(Resource):
+    @idempotent
+    @marshal_with(coupon_redemption_fields)
+    def post(self, id):
+        """
+        Redeem one use of a coupon for a user, optionally for an order
+
+        The use is claimed with a single conditional UPDATE, so usage_limit
+        holds under concurrent redemptions. Answers 409 when the coupon is
+        inactive, outside its window or used up.
+        """
+        args = coupon_redemption_parser.parse_args()
+        if not User.query.get(args['user_id']):
+            abort(404, message=f"User with id {args['user_id']} not found")
+        if args['order_id'] is not None and not Order.query.get(args['order_id']):
+            abort(404, message=f"Order with id {args['order_id']} not found")
+        if not db.session.query(Coupon.id).filter_by(id=id).first():
+            abort(404, message=f"Coupon with id {id} not found")
+        try:
+            redemption = claim_coupon(id, args['user_id'], args['order_id'])
+        except CouponUnavailable as e:
+            db.session.rollback()
+            abort(409, message=str(e))
+        db.session.commit()
+        return redemption, 201
+
+class CouponRedemptionResource(Resource):
+    def delete(self, id):
+        """Release a redemption, giving its use back to the coupon"""
+        if not release_coupon(id):
+            abort(404, message=f"Coupon redemption with id {id} not found")
+        db.session.commit()
+        return {'message': 'Coupon redemption released'}, 200
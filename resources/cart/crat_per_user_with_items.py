@@ -1,10 +1,17 @@
-from flask_restful import Resource, reqparse, fields, marshal_with, marshal, abort
+from flask import request
+from flask_restful import Resource, reqparse, fields, abort
 from models.cart import Cart
 from models.product_variant import ProductVariant
 from models.cart_item import CartItem
 from models.user import User
 from extensions import db
+from utils.idempotency import idempotent
 from sqlalchemy.orm import joinedload
+from utils.serializer import compile_fields
+from utils.pricing import price_cart
+from utils.cart_ops import (get_or_create_cart, add_cart_item, fold_cart_operations,
+    apply_cart_operations, CartOperationError, bump_cart_version, cart_etag, CartVersionConflict,
+    CART_OPERATIONS, IDEMPOTENT_CART_OPERATIONS)
 
 cart_item_nested_fields = {
     'id': fields.Integer,
@@ -39,6 +46,7 @@ cart_detail_fields = {
     'dicounted_total_price': fields.Float,
     'actual_amount': fields.Float,
     'updated_at': fields.DateTime,
+    'version': fields.Integer,
     # Nested cart items
     'cart_items': fields.List(fields.Nested(cart_item_nested_fields)),
     # User details
@@ -50,33 +58,163 @@ cart_detail_fields = {
     })
 }
 
-# Parser for cart updates
+serialize_cart = compile_fields(cart_detail_fields)
+
+# Parser for cart updates; discounts and totals are computed by the pricing engine
 cart_update_parser = reqparse.RequestParser()
 cart_update_parser.add_argument('coupon_active', type=int, choices=[0, 1])
 cart_update_parser.add_argument('coupon_id', type=int)
 cart_update_parser.add_argument('coupon_code', type=str)
-cart_update_parser.add_argument('coupon_discount', type=float)
-cart_update_parser.add_argument('dicounted_total_price', type=float)
-cart_update_parser.add_argument('actual_amount', type=float )
+
+# Parser for adding a variant to a user's cart
+cart_item_add_parser = reqparse.RequestParser()
+cart_item_add_parser.add_argument('product_variant_id', type=int, required=True)
+cart_item_add_parser.add_argument('quantity', type=int, default=1)
+
+
+class CartView:
+    """
+    Cart with its priced items attached as a plain list, so the serializer
+    does not go through the dynamic cart_items relationship.
+    """
+
+    def __init__(self, cart, items):
+        self._cart = cart
+        self.cart_items = items
+
+    def __getattr__(self, name):
+        return getattr(self._cart, name)
+
+
+def expected_cart_version(cart):
+    """
+    Cart version required by the request's If-Match header, or None when it
+    sends none (or *). Aborts with 412 when the header names another version.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    if not if_match.contains(str(cart.version)):
+        abort(412, message=f"Cart has changed, current version is {cart.version}")
+    return cart.version
+
+
+def claim_cart_version(cart, expected_version=None):
+    """Bump the cart version in the current transaction, aborting with 412 on conflict"""
+    try:
+        bump_cart_version(cart, expected_version)
+    except CartVersionConflict as e:
+        db.session.rollback()
+        abort(412, message=str(e))
+
+
+def commit_cart(cart, expected_version=None):
+    """
+    Bump the cart version and commit, with a compare-and-swap when the
+    request sent If-Match. Returns the new ETag; aborts with 412 on conflict.
+    """
+    claim_cart_version(cart, expected_version)
+    etag = cart_etag(cart.version)
+    db.session.commit()
+    return etag
+
+
+def priced_cart_response(cart, status=200, write=True, expected_version=None):
+    """
+    Price the cart and return it with its items and ETag. Changes are
+    committed with a version bump when `write` is set; reads commit only when
+    prices or promotions moved, and answer 304 to a matching If-None-Match.
+    """
+    pricing = price_cart(cart)
+    changed = write or pricing.changed
+    if not changed and request.if_none_match.contains(str(cart.version)):
+        return '', 304, {'ETag': cart_etag(cart.version)}
+    
+    db.session.flush()
+    if changed:
+        claim_cart_version(cart, expected_version)
+    # Serialized before the commit expires the objects; the pricing result
+    # holds the variants and products, so product_variant needs no query
+    document = serialize_cart(CartView(cart, pricing.items))
+    if changed:
+        db.session.commit()
+    return {
+        'success': True,
+        'cart': document
+    }, status, {'ETag': cart_etag(document['version'])}
+
+
+def update_cart(cart):
+    """Apply the request's coupon fields to a cart and return it repriced"""
+    expected_version = expected_cart_version(cart)
+    args = cart_update_parser.parse_args()
+    # Update only provided fields
+    for key, value in args.items():
+        if value is not None:
+            setattr(cart, key, value)
+    return priced_cart_response(cart, expected_version=expected_version)
+
+
+def parse_cart_operations(allowed=CART_OPERATIONS):
+    """
+    Fold the request's batch operations to one action per variant and load
+    the prices of added and set variants, aborting with 400 or 404.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        actions = fold_cart_operations(data.get('operations'), allowed)
+    except CartOperationError as e:
+        abort(400, message=str(e))
+    
+    # Variants being added or set must exist; their price seeds new lines
+    variant_ids = [variant_id for variant_id, (action, _) in actions.items() if action != 'remove']
+    prices = dict(
+        db.session.query(ProductVariant.id, ProductVariant.variant_price)
+        .filter(ProductVariant.id.in_(variant_ids)).all()
+    ) if variant_ids else {}
+    missing = sorted(set(variant_ids) - set(prices))
+    if missing:
+        abort(404, message=f"Product variants not found: {', '.join(map(str, missing))}")
+    return actions, prices
+
+
+def apply_cart_batch(cart, actions, prices):
+    """Apply parsed batch operations to a cart and return it repriced"""
+    expected_version = expected_cart_version(cart)
+    apply_cart_operations(cart.id, actions, prices)
+    return priced_cart_response(cart, expected_version=expected_version)
+
+
+def parse_cart_item_add():
+    """The variant and quantity to add from the request, aborting with 400 or 404"""
+    args = cart_item_add_parser.parse_args()
+    if args['quantity'] is None or args['quantity'] < 1:
+        abort(400, message="quantity must be at least 1")
+    variant = ProductVariant.query.get(args['product_variant_id'])
+    if not variant:
+        abort(404, message=f"Product variant with id {args['product_variant_id']} not found")
+    return variant, args['quantity']
+
+
+def add_item_to_cart(cart, variant, quantity):
+    """Add a variant to a cart with a single upsert and return the cart repriced"""
+    expected_version = expected_cart_version(cart)
+    add_cart_item(cart.id, variant.id, quantity, variant.variant_price)
+    return priced_cart_response(cart, expected_version=expected_version)
+
 
 class CartResourceAdvanced(Resource):
     def get(self, user_id):
         """
-        Get cart with all items and product details by user_id
+        Get cart with all items and product details by user_id, priced with
+        current variant prices, promotions and coupon
         """
-               
-        cart = Cart.query.options(
-            joinedload(Cart.user),
-            joinedload(Cart.cart_items).joinedload(CartItem.product_variant).joinedload(ProductVariant.product)
-        ).filter_by(user_id=user_id).first()
+        cart = Cart.query.options(joinedload(Cart.user)).filter_by(user_id=user_id).first()
         
         if not cart:
             abort(404, message=f"Cart for user_id {user_id} not found")
         
-        return {
-            'success': True,
-            'cart': marshal(cart, cart_detail_fields)
-        }, 200
+        return priced_cart_response(cart, write=False)
     def post(self,user_id):
         """create new cart for user with user_id"""
         #check if user exists 
@@ -90,38 +228,41 @@ class CartResourceAdvanced(Resource):
         args = cart_update_parser.parse_args()
         cart = Cart(
             user_id=user_id,
-            coupon_active=args.get('coupon_active', 0),
+            coupon_active=args.get('coupon_active') or 0,
             coupon_id=args.get('coupon_id'),
-            coupon_code=args.get('coupon_code'),
-            coupon_discount=args.get('coupon_discount', 0.0),
-            dicounted_total_price=args.get('dicounted_total_price', 0.0),
-            actual_amount=args.get('actual_amount', 0.0))
+            coupon_code=args.get('coupon_code'))
         db.session.add(cart)
-        db.session.commit()
-        cart = Cart.query.options(joinedload(Cart.user), joinedload(Cart.cart_items)).filter_by(id=cart.id).first()
-        return {
-            'success': True,
-            'cart': marshal(cart, cart_detail_fields)
-        }, 201
+        db.session.flush()
+        return priced_cart_response(cart, 201)
     def patch(self, user_id):
          """Update cart details by user_id"""
-         cart = Cart.query.filter_by(user_id=user_id).first()
+         cart = Cart.query.options(joinedload(Cart.user)).filter_by(user_id=user_id).first()
          if not cart:
              abort(404, message=f"Cart for user_id {user_id} not found") 
-         args = cart_update_parser.parse_args()
-         # Update only provided fields
-         for key, value in args.items():
-             if value is not None:
-                 setattr(cart, key, value)
-         db.session.commit()
-         cart = Cart.query.options(
-             joinedload(cart.user),
-             joinedload(cart.cart_items).joinedload(CartItem.product_variant).joinedload(ProductVariant.product)
-         ).filter_by(user_id=user_id).first()
-         return {
-             'success': True,
-             'cart': marshal(cart, cart_detail_fields)
-         }, 200
+         return update_cart(cart)
+    def put(self, user_id):
+        """
+        Apply a batch of set/remove operations in one transaction
+
+        Only operations that leave the same cart when the request is repeated
+        are accepted; batches with adds go to POST /api/user/<user_id>/carts/operations.
+        The cart is created if the user has none.
+
+        JSON body:
+        {
+            "operations": [
+                {"op": "set", "product_variant_id": 2, "quantity": 5},
+                {"op": "remove", "product_variant_id": 3}
+            ]
+        }
+        """
+        actions, prices = parse_cart_operations(IDEMPOTENT_CART_OPERATIONS)
+        
+        user = User.query.get(user_id)
+        if not user:
+            abort(404, message=f"User with id {user_id} not found")
+        
+        return apply_cart_batch(get_or_create_cart(user_id), actions, prices)
     def delete(self, user_id):
         """
         Delete cart and all associated cart items by user_id
@@ -131,6 +272,11 @@ class CartResourceAdvanced(Resource):
         if not cart:
             abort(404, message=f"Cart for user_id {user_id} not found")
         
+        expected_version = expected_cart_version(cart)
+        if expected_version is not None:
+            # Fails with 412 if the cart changed since the client read it
+            claim_cart_version(cart, expected_version)
+        
         # Delete associated cart items first
         CartItem.query.filter_by(cart_id=cart.id).delete()
         
@@ -142,4 +288,58 @@ class CartResourceAdvanced(Resource):
             'success': True,
             'message': f'Cart for user_id {user_id} deleted successfully'
         }, 200
- 
\ No newline at end of file
+
+
+class CartItemsAdvanced(Resource):
+    @idempotent
+    def post(self, user_id):
+        """
+        Add a product variant to the user's cart
+
+        The cart is created if the user has none, and a variant already in
+        the cart has its quantity incremented by a single upsert, so repeated
+        or concurrent adds never create duplicate lines. Returns the repriced
+        cart.
+
+        JSON body:
+        {
+            "product_variant_id": 1,
+            "quantity": 2
+        }
+        """
+        variant, quantity = parse_cart_item_add()
+        
+        user = User.query.get(user_id)
+        if not user:
+            abort(404, message=f"User with id {user_id} not found")
+        
+        return add_item_to_cart(get_or_create_cart(user_id), variant, quantity)
+
+
+class CartOperationsAdvanced(Resource):
+    @idempotent
+    def post(self, user_id):
+        """
+        Apply a batch of cart operations in one transaction
+
+        Operations are applied in order and reduced to one change per variant,
+        then written with one delete and two multi-row upserts, followed by a
+        single repricing pass. The cart is created if the user has none. Adds
+        are not idempotent; send an Idempotency-Key to retry safely.
+
+        JSON body:
+        {
+            "operations": [
+                {"op": "add", "product_variant_id": 1, "quantity": 2},
+                {"op": "set", "product_variant_id": 2, "quantity": 5},
+                {"op": "remove", "product_variant_id": 3}
+            ]
+        }
+        """
+        actions, prices = parse_cart_operations()
+        
+        user = User.query.get(user_id)
+        if not user:
+            abort(404, message=f"User with id {user_id} not found")
+        
+        return apply_cart_batch(get_or_create_cart(user_id), actions, prices)
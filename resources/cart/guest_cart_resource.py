@@ -0,0 +1,76 @@
+from flask_restful import Resource, abort
+from models.cart import Cart
+from models.cart_item import CartItem
+from extensions import db
+from utils.idempotency import idempotent
+from utils.cart_ops import create_guest_cart, IDEMPOTENT_CART_OPERATIONS
+from resources.cart.crat_per_user_with_items import (priced_cart_response, update_cart,
+    parse_cart_operations, apply_cart_batch, parse_cart_item_add, add_item_to_cart,
+    expected_cart_version, claim_cart_version)
+
+
+def guest_cart_or_404(guest_token):
+    cart = Cart.query.filter_by(guest_token=guest_token).first()
+    if not cart:
+        abort(404, message="Guest cart not found")
+    return cart
+
+
+class GuestCartListResource(Resource):
+    def post(self):
+        """
+        Create an anonymous cart
+
+        Returns the cart and its guest_token. The token is the only key to
+        the cart; send it to /api/login as guest_token to merge the cart into
+        the user's cart after login.
+        """
+        cart = create_guest_cart()
+        response, status, headers = priced_cart_response(cart, 201)
+        response['guest_token'] = cart.guest_token
+        return response, status, headers
+
+
+class GuestCartResource(Resource):
+    def get(self, guest_token):
+        """Get the guest cart with its items, priced"""
+        return priced_cart_response(guest_cart_or_404(guest_token), write=False)
+
+    def patch(self, guest_token):
+        """Update the guest cart's coupon"""
+        return update_cart(guest_cart_or_404(guest_token))
+
+    def put(self, guest_token):
+        """Apply a batch of set/remove operations, like PUT /api/user/<user_id>/carts"""
+        actions, prices = parse_cart_operations(IDEMPOTENT_CART_OPERATIONS)
+        return apply_cart_batch(guest_cart_or_404(guest_token), actions, prices)
+
+    def delete(self, guest_token):
+        """Delete the guest cart and its items"""
+        cart = guest_cart_or_404(guest_token)
+        expected_version = expected_cart_version(cart)
+        if expected_version is not None:
+            claim_cart_version(cart, expected_version)
+        CartItem.query.filter_by(cart_id=cart.id).delete()
+        db.session.delete(cart)
+        db.session.commit()
+        return {
+            'success': True,
+            'message': 'Guest cart deleted successfully'
+        }, 200
+
+
+class GuestCartItemsResource(Resource):
+    @idempotent
+    def post(self, guest_token):
+        """Add a product variant to the guest cart, like POST /api/user/<user_id>/carts/items"""
+        variant, quantity = parse_cart_item_add()
+        return add_item_to_cart(guest_cart_or_404(guest_token), variant, quantity)
+
+
+class GuestCartOperationsResource(Resource):
+    @idempotent
+    def post(self, guest_token):
+        """Apply a batch of add/set/remove operations, like POST /api/user/<user_id>/carts/operations"""
+        actions, prices = parse_cart_operations()
+        return apply_cart_batch(guest_cart_or_404(guest_token), actions, prices)
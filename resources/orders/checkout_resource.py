@@ -0,0 +1,73 @@
+from flask_restful import Resource, reqparse, fields, marshal, abort
+from models.user import User
+from models.address import Address
+from extensions import db
+from utils.idempotency import idempotent
+from utils.checkout import checkout_cart, lock_user_cart, CheckoutError, OutOfStock
+from utils.coupon_ops import CouponUnavailable
+from utils.cart_ops import CartVersionConflict
+from resources.orders.order_resource import order_fields
+from resources.orders.order_item_resource import order_item_fields
+from resources.cart.crat_per_user_with_items import expected_cart_version
+
+checkout_parser = reqparse.RequestParser()
+checkout_parser.add_argument('address_id', type=int, required=True)
+
+
+class CheckoutResource(Resource):
+    @idempotent
+    def post(self, user_id):
+        """
+        Place an order for everything in the user's cart
+
+        In one transaction the cart is repriced from current prices,
+        promotions and coupon, the order and its items are created, stock is
+        held until the order is paid, the coupon use is claimed and the cart
+        is emptied. Totals are never taken from the client; an order left
+        unpaid when its hold expires is cancelled. Answers 409 when stock or the coupon ran
+        out, and 412 when If-Match names an outdated cart version.
+
+        JSON body:
+        {
+            "address_id": 1
+        }
+        """
+        args = checkout_parser.parse_args()
+        
+        user = User.query.get(user_id)
+        if not user:
+            abort(404, message=f"User with id {user_id} not found")
+        address = Address.query.filter_by(id=args['address_id'], user_id=user_id).first()
+        if not address:
+            abort(404, message=f"Address with id {args['address_id']} not found for user_id {user_id}")
+        
+        # Locked so concurrent checkouts of the same cart place one order
+        cart = lock_user_cart(user_id)
+        if not cart:
+            abort(404, message=f"Cart for user_id {user_id} not found")
+        expected_version = expected_cart_version(cart)
+        
+        try:
+            order, items, hold_expires_at = checkout_cart(cart, address.id, expected_version)
+        except OutOfStock as e:
+            db.session.rollback()
+            abort(409, message=str(e), product_variant_ids=e.variant_ids)
+        except CouponUnavailable:
+            db.session.rollback()
+            abort(409, message="The cart's coupon is no longer available; remove it and try again")
+        except CartVersionConflict as e:
+            db.session.rollback()
+            abort(412, message=str(e))
+        except CheckoutError as e:
+            db.session.rollback()
+            abort(400, message=str(e))
+        
+        # Serialized before the commit expires the objects
+        document = marshal(order, order_fields)
+        document['order_items'] = marshal(items, order_item_fields)
+        document['hold_expires_at'] = fields.DateTime().format(hold_expires_at)
+        db.session.commit()
+        return {
+            'success': True,
+            'order': document
+        }, 201
@@ -1,6 +1,7 @@
 from flask_restful import Resource, reqparse, fields, marshal_with
 from models.order_item import OrderItem
 from extensions import db
+from utils.idempotency import idempotent
 
 order_item_fields = {
     'id': fields.Integer,
@@ -24,6 +25,7 @@ class OrderItemListResource(Resource):
         items = OrderItem.query.all()
         return items
     
+    @idempotent
     @marshal_with(order_item_fields)
     def post(self):
         args = order_item_parser.parse_args()
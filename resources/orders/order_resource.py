@@ -1,6 +1,20 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask import request
+from flask_restful import Resource, reqparse, fields, marshal_with, abort
+from sqlalchemy import or_, and_, update
 from models.order import Order
+from models.order_item import OrderItem
+from models.order_event import OrderEvent
+from models.user import User
 from extensions import db
+from utils.idempotency import idempotent
+from utils.coupon_ops import release_order_coupons
+from utils.inventory import lock_order_holds, take_order_stock, release_order_holds
+from utils.order_events import record_status_changes
+from utils.order_status import transition_orders, ORDER_TRANSITIONS, MAX_ORDER_TRANSITIONS
+from utils.product_cache import get_product_cache
+from utils.serializer import compile_fields
+from utils.pagination import clamp_limit, encode_cursor, decode_cursor, InvalidCursor
+from resources.orders.order_item_resource import order_item_fields
 
 order_fields = {
     'id': fields.Integer,
@@ -16,6 +30,21 @@ order_fields = {
     'sub_total': fields.Float
 }
 
+order_event_fields = {
+    'id': fields.Integer,
+    'order_id': fields.Integer,
+    'from_status': fields.String,
+    'to_status': fields.String,
+    'source': fields.String,
+    'created_at': fields.DateTime
+}
+
+serialize_order = compile_fields(order_fields)
+serialize_order_item = compile_fields(order_item_fields)
+
+ORDER_STATUSES = Order.order_status.type.enums
+PAYMENT_STATUSES = Order.payment_status.type.enums
+
 order_parser = reqparse.RequestParser()
 order_parser.add_argument('user_id', type=int, required=True)
 order_parser.add_argument('address_id', type=int, required=True)
@@ -27,12 +56,21 @@ order_parser.add_argument('discount_source', type=str)
 order_parser.add_argument('discount_amount', type=float)
 order_parser.add_argument('sub_total', type=float, required=True)
 
+# Query parameters for a user's order history
+user_order_list_parser = reqparse.RequestParser()
+user_order_list_parser.add_argument('limit', type=int, location='args')
+user_order_list_parser.add_argument('cursor', type=str, location='args')
+user_order_list_parser.add_argument('status', type=str, location='args')
+user_order_list_parser.add_argument('payment_status', type=str, location='args', choices=PAYMENT_STATUSES)
+user_order_list_parser.add_argument('include_items', type=int, location='args', choices=[0, 1], default=0)
+
 class OrderListResource(Resource):
     @marshal_with(order_fields)
     def get(self):
         orders = Order.query.all()
         return orders
     
+    @idempotent
     @marshal_with(order_fields)
     def post(self):
         args = order_parser.parse_args()
@@ -41,6 +79,74 @@ class OrderListResource(Resource):
         db.session.commit()
         return order, 201
 
+class UserOrderListResource(Resource):
+    def get(self, user_id):
+        """
+        Get a page of a user's orders, newest first
+
+        Pages are read with keyset pagination on (created_at, id) over the
+        (user_id, created_at, id) index, so every page costs the same.
+
+        Query params:
+        - limit: int (default 20, max 100)
+        - cursor: string (next_cursor from the previous page)
+        - status: comma separated order_status values
+        - payment_status: pending | paid | failed
+        - include_items: int (0 or 1), order_items of every order in one query
+        """
+        args = user_order_list_parser.parse_args()
+        limit = clamp_limit(args['limit'])
+        
+        if not db.session.query(User.id).filter_by(id=user_id).first():
+            abort(404, message=f"User with id {user_id} not found")
+        
+        query = Order.query.filter(Order.user_id == user_id)
+        if args['status']:
+            statuses = [status.strip() for status in args['status'].split(',') if status.strip()]
+            unknown = [status for status in statuses if status not in ORDER_STATUSES]
+            if unknown:
+                abort(400, message=f"Unknown order status: {', '.join(unknown)}")
+            query = query.filter(Order.order_status.in_(statuses))
+        if args['payment_status']:
+            query = query.filter(Order.payment_status == args['payment_status'])
+        if args['cursor']:
+            try:
+                created_at, last_id = decode_cursor(args['cursor'], 2)
+            except InvalidCursor as e:
+                abort(400, message=str(e))
+            # id breaks ties between orders created in the same second
+            query = query.filter(or_(
+                Order.created_at < created_at,
+                and_(Order.created_at == created_at, Order.id < last_id)
+            ))
+        
+        # Fetch one extra row to know whether another page exists
+        orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            next_cursor = encode_cursor(orders[-1].created_at, orders[-1].id)
+        
+        documents = [serialize_order(order) for order in orders]
+        if args['include_items'] and orders:
+            items_by_order = {order.id: [] for order in orders}
+            items = (
+                OrderItem.query.filter(OrderItem.order_id.in_(list(items_by_order)))
+                .order_by(OrderItem.order_id, OrderItem.id).all()
+            )
+            for item in items:
+                items_by_order[item.order_id].append(serialize_order_item(item))
+            for document in documents:
+                document['order_items'] = items_by_order[document['id']]
+        
+        return {
+            'success': True,
+            'count': len(documents),
+            'orders': documents,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }, 200
+
 class OrderResource(Resource):
     @marshal_with(order_fields)
     def get(self, id):
@@ -51,14 +157,129 @@ class OrderResource(Resource):
     def patch(self, id):
         args = order_parser.parse_args()
         order = Order.query.get_or_404(id)
+        target_status = args.get('order_status')
+        if target_status is not None and target_status not in ORDER_TRANSITIONS:
+            abort(400, message=f"Unknown order status: {target_status}")
+        paying = args.get('payment_status') == 'paid' and order.payment_status != 'paid'
+        # Holds are locked before the order row, in the same order as the
+        # hold expiry pass and bulk transitions
+        if target_status == 'cancelled':
+            lock_order_holds([order.id])
+        sold_product_ids = []
+        if paying:
+            # Held stock becomes sold; waits for an expiry pass holding it
+            sold_product_ids = take_order_stock(order.id)
+        db.session.refresh(order, with_for_update=True)
+        previous_status = order.order_status
+        if target_status not in (None, previous_status) and target_status not in ORDER_TRANSITIONS.get(previous_status, ()):
+            db.session.rollback()
+            abort(409, message=f"Order {id} cannot move from {previous_status} to {target_status}")
+        if paying:
+            if previous_status == 'cancelled':
+                db.session.rollback()
+                abort(409, message=f"Order {id} was cancelled, its stock hold expired")
+            if sold_product_ids is None:
+                db.session.rollback()
+                abort(409, message=f"Not enough stock left for order {id}, its stock hold expired")
+        if target_status == 'cancelled' and previous_status != 'cancelled':
+            # Give the order's held stock and coupon uses back
+            release_order_holds([order.id])
+            release_order_coupons([order.id])
         for key, value in args.items():
             if value is not None:
                 setattr(order, key, value)
+        if order.order_status != previous_status:
+            record_status_changes([(order.id, previous_status, order.order_status)], 'api')
         db.session.commit()
+        # Product documents carry stock_quantity
+        for product_id in sold_product_ids:
+            get_product_cache().invalidate(product_id)
         return order
     
     def delete(self, id):
         order = Order.query.get_or_404(id)
+        lock_order_holds([order.id])
+        db.session.refresh(order, with_for_update=True)
+        if order.payment_status == 'paid':
+            # Its stock was sold and its coupon uses count
+            db.session.rollback()
+            abort(409, message=f"Order {id} is paid and cannot be deleted")
+        # Held stock and coupon uses go back, as for a cancel
+        release_order_holds([order.id])
+        release_order_coupons([order.id])
+        # The status history is kept, detached from the deleted order
+        db.session.execute(
+            update(OrderEvent).where(OrderEvent.order_id == order.id).values(order_id=None),
+            execution_options={'synchronize_session': False}
+        )
+        OrderItem.query.filter_by(order_id=order.id).delete(synchronize_session=False)
         db.session.delete(order)
         db.session.commit()
         return {'message': 'Order deleted'}, 204
+
+
+class OrderStatusBulkResource(Resource):
+    def post(self):
+        """
+        Move many orders to new statuses in one transaction
+
+        Moves allowed by ORDER_TRANSITIONS are applied with one UPDATE per
+        target status and logged to the order events; orders already in the
+        wanted status are left alone, and the rest are reported as rejected.
+        Cancelled orders give their held stock and coupon uses back.
+
+        JSON body, either one status for many orders:
+        {
+            "order_ids": [1, 2, 3],
+            "order_status": "out_for_Delivery"
+        }
+        or a status per order:
+        {
+            "transitions": [
+                {"order_id": 1, "order_status": "delivered"},
+                {"order_id": 2, "order_status": "cancelled"}
+            ]
+        }
+        """
+        data = request.get_json(silent=True) or {}
+        if 'transitions' in data:
+            transitions = data['transitions']
+            if not isinstance(transitions, list) or not all(isinstance(t, dict) for t in transitions):
+                abort(400, message="transitions must be a list of {order_id, order_status} objects")
+            pairs = [(t.get('order_id'), t.get('order_status')) for t in transitions]
+        else:
+            order_ids = data.get('order_ids')
+            if not isinstance(order_ids, list):
+                abort(400, message="order_ids must be a list of order ids")
+            pairs = [(order_id, data.get('order_status')) for order_id in order_ids]
+        
+        if not pairs:
+            abort(400, message="No orders given")
+        if len(pairs) > MAX_ORDER_TRANSITIONS:
+            abort(400, message=f"At most {MAX_ORDER_TRANSITIONS} orders are allowed per request")
+        targets = {}
+        for order_id, status in pairs:
+            if not isinstance(order_id, int) or isinstance(order_id, bool):
+                abort(400, message="order_id must be an integer")
+            if status not in ORDER_STATUSES:
+                abort(400, message=f"Unknown order status: {status}")
+            if targets.setdefault(order_id, status) != status:
+                abort(400, message=f"Order {order_id} is given more than one status")
+        
+        applied, unchanged, rejected = transition_orders(targets)
+        db.session.commit()
+        return {
+            'success': True,
+            'updated': applied,
+            'updated_count': sum(len(order_ids) for order_ids in applied.values()),
+            'unchanged': unchanged,
+            'rejected': rejected
+        }, 200
+
+class OrderEventListResource(Resource):
+    @marshal_with(order_event_fields)
+    def get(self, id):
+        """Status history of an order, oldest first"""
+        if not db.session.query(Order.id).filter_by(id=id).first():
+            abort(404, message=f"Order with id {id} not found")
+        return OrderEvent.query.filter_by(order_id=id).order_by(OrderEvent.id).all()
@@ -1,6 +1,7 @@
 from flask_restful import Resource, reqparse, fields, marshal_with
 from models.category import Category
 from extensions import db
+from utils.product_cache import get_product_cache
 
 category_fields = {
     'id': fields.Integer,
@@ -41,10 +42,13 @@ class CategoryResource(Resource):
             if value is not None:
                 setattr(category, key, value)
         db.session.commit()
+        # Category data is embedded in every product document of the category
+        get_product_cache().clear()
         return category
     
     def delete(self, id):
         category = Category.query.get_or_404(id)
         db.session.delete(category)
         db.session.commit()
+        get_product_cache().clear()
         return {'message': 'Category deleted'}, 204
\ No newline at end of file
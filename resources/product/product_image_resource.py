@@ -1,6 +1,9 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask_restful import Resource, reqparse, fields, marshal_with, abort
 from models.product_image import ProductImage
 from extensions import db
+from utils.image_store import release_image_rows
+from utils.storage_deletions import enqueue_storage_deletions
+from utils.product_cache import get_product_cache
 
 product_image_fields = {
     'id': fields.Integer,
@@ -16,6 +19,10 @@ product_image_parser.add_argument('image_path', type=str, required=True)
 product_image_parser.add_argument('alt_text', type=str)
 product_image_parser.add_argument('is_primary', type=int, choices=[0, 1])
 
+# image_path is fixed once stored: the row holds a reference to its content
+product_image_update_parser = product_image_parser.copy()
+product_image_update_parser.replace_argument('image_path', type=str)
+
 class ProductImageListResource(Resource):
     @marshal_with(product_image_fields)
     def get(self):
@@ -28,6 +35,7 @@ class ProductImageListResource(Resource):
         image = ProductImage(**args)
         db.session.add(image)
         db.session.commit()
+        get_product_cache().invalidate(image.product_id)
         return image, 201
 
 class ProductImageResource(Resource):
@@ -38,16 +46,27 @@ class ProductImageResource(Resource):
     
     @marshal_with(product_image_fields)
     def patch(self, id):
-        args = product_image_parser.parse_args()
+        args = product_image_update_parser.parse_args()
         image = ProductImage.query.get_or_404(id)
+        if args['image_path'] is not None and args['image_path'] != image.image_path:
+            abort(400, message="image_path cannot be changed, upload a new image instead")
+        previous_product_id = image.product_id
         for key, value in args.items():
             if value is not None:
                 setattr(image, key, value)
         db.session.commit()
+        get_product_cache().invalidate(previous_product_id)
+        get_product_cache().invalidate(image.product_id)
         return image
     
     def delete(self, id):
         image = ProductImage.query.get_or_404(id)
+        product_id = image.product_id
+        # The object is queued in the same transaction and goes only when
+        # nothing else references its content
+        unreferenced = release_image_rows([image])
         db.session.delete(image)
+        enqueue_storage_deletions(unreferenced)
         db.session.commit()
+        get_product_cache().invalidate(product_id)
         return {'message': 'Product image deleted'}, 204
\ No newline at end of file
@@ -3,12 +3,11 @@ from flask_restful import Resource, abort
 from models.product import Product
 from models.product_image import ProductImage
 from extensions import db
-from utils.b2_storage import B2Storage
+from utils.storage import get_storage
+from utils.image_store import release_images
+from utils.storage_deletions import enqueue_storage_deletions
 from werkzeug.datastructures import FileStorage
 
-# Initialize B2 Storage
-b2_storage = B2Storage()
-
 class ProductImageUploadResource(Resource):
     """
     Upload images for a product
@@ -50,7 +49,7 @@ class ProductImageUploadResource(Resource):
         
         try:
             # Upload files to B2
-            upload_results = b2_storage.upload_multiple_files(valid_files, folder="products")
+            upload_results = get_storage().upload_multiple_files(valid_files, folder="products")
             
             # Get alt_text and is_primary from form
             alt_texts = request.form.getlist('alt_text')
@@ -129,11 +128,14 @@ class ProductImageDeleteResource(Resource):
             abort(404, message=f"Image with id {image_id} not found")
         
         try:
-            # Delete from B2 storage
-            b2_storage.delete_file(image.image_path)
-            
-            # Delete from database
+            # Delete from database; the storage object is queued in the same
+            # transaction and removed by the deletion worker
+            if image.content_hash:
+                unreferenced = release_images([image.content_hash])
+            else:
+                unreferenced = [image.image_path]
             db.session.delete(image)
+            enqueue_storage_deletions(unreferenced)
             db.session.commit()
             
             return {
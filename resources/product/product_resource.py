@@ -1,6 +1,10 @@
 from flask_restful import Resource, reqparse, fields, marshal_with
 from models.product import Product
+from models.product_image import ProductImage
 from extensions import db
+from utils.image_store import release_image_rows
+from utils.storage_deletions import enqueue_storage_deletions
+from utils.product_cache import get_product_cache
 
 product_fields = {
     'id': fields.Integer,
@@ -50,10 +54,17 @@ class ProductResource(Resource):
             if value is not None:
                 setattr(product, key, value)
         db.session.commit()
+        get_product_cache().invalidate(id)
         return product
     
     def delete(self, id):
         product = Product.query.get_or_404(id)
+        # Release the product's images as DELETE /api/products/<id>/complete does
+        images = ProductImage.query.filter_by(product_id=id).all()
+        unreferenced = release_image_rows(images)
+        ProductImage.query.filter_by(product_id=id).delete()
         db.session.delete(product)
+        enqueue_storage_deletions(unreferenced)
         db.session.commit()
+        get_product_cache().invalidate(id)
         return {'message': 'Product deleted'}, 204
\ No newline at end of file
@@ -1,6 +1,12 @@
-from flask_restful import Resource, reqparse, fields, marshal_with
+from flask import request
+from flask_restful import Resource, reqparse, fields, marshal_with, abort
 from models.product_variant import ProductVariant
 from extensions import db
+from utils.product_cache import get_product_cache
+from utils.inventory import get_availability_cache
+
+# Most variant ids accepted by one availability request
+MAX_AVAILABILITY_IDS = 200
 
 product_variant_fields = {
     'id': fields.Integer,
@@ -8,6 +14,7 @@ product_variant_fields = {
     'variant_name': fields.String,
     'variant_price': fields.Float,
     'stock_quantity': fields.Integer,
+    'reserved_quantity': fields.Integer,
     'quantity_unit': fields.String
 }
 
@@ -30,8 +37,32 @@ class ProductVariantListResource(Resource):
         variant = ProductVariant(**args)
         db.session.add(variant)
         db.session.commit()
+        get_product_cache().invalidate(variant.product_id)
         return variant, 201
 
+class ProductVariantAvailabilityResource(Resource):
+    def get(self):
+        """
+        Units available to order (stock minus units held for unpaid orders)
+        for ?ids=1,2,3, from a cache refreshed every few seconds. Unknown ids
+        are left out.
+        """
+        try:
+            ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            abort(400, message="ids must be a comma separated list of integers")
+        if not ids:
+            abort(400, message="ids is required")
+        if len(ids) > MAX_AVAILABILITY_IDS:
+            abort(400, message=f"At most {MAX_AVAILABILITY_IDS} ids are allowed per request")
+        available = get_availability_cache().get_many(list(dict.fromkeys(ids)))
+        return {
+            'availability': [
+                {'product_variant_id': variant_id, 'available': units}
+                for variant_id, units in available.items()
+            ]
+        }, 200
+
 class ProductVariantResource(Resource):
     @marshal_with(product_variant_fields)
     def get(self, id):
@@ -42,14 +73,19 @@ class ProductVariantResource(Resource):
     def patch(self, id):
         args = product_variant_parser.parse_args()
         variant = ProductVariant.query.get_or_404(id)
+        previous_product_id = variant.product_id
         for key, value in args.items():
             if value is not None:
                 setattr(variant, key, value)
         db.session.commit()
+        get_product_cache().invalidate(previous_product_id)
+        get_product_cache().invalidate(variant.product_id)
         return variant
     
     def delete(self, id):
         variant = ProductVariant.query.get_or_404(id)
+        product_id = variant.product_id
         db.session.delete(variant)
         db.session.commit()
+        get_product_cache().invalidate(product_id)
         return {'message': 'Product variant deleted'}, 204
\ No newline at end of file
@@ -1,27 +1,29 @@
 from flask import request
-from flask_restful import Resource, reqparse, fields, marshal, abort
+from flask_restful import Resource, reqparse, fields, abort
 from models.product import Product
 from models.product_image import ProductImage
+from models.image_derivative import ImageDerivative
 from models.product_variant import ProductVariant
 from models.category import Category
 from extensions import db
+from sqlalchemy import and_, or_, exists
 from sqlalchemy.orm import joinedload
 from datetime import datetime
 from werkzeug.exceptions import HTTPException
 
-# Import B2 storage
-from utils.b2_storage import get_b2_storage
+# Import storage
+from utils.image_urls import build_image_url
+from utils.image_store import store_images, link_images, release_image_rows, discard_images
+from utils.storage_deletions import enqueue_storage_deletions
+from utils.derivatives import schedule_derivatives, DERIVATIVE_SIZES
+from utils.pagination import clamp_limit, encode_cursor, decode_cursor, InvalidCursor
+from utils.product_cache import get_product_cache
+from utils.serializer import compile_fields
 
 # Custom field to convert image_path to full URL
 class ImageUrlField(fields.Raw):
     def format(self, value):
-        if value:
-            try:
-                storage = get_b2_storage()
-                return storage.get_file_url(value)
-            except:
-                return None
-        return None
+        return build_image_url(value)
 
 # Field definitions
 category_fields = {
@@ -30,13 +32,23 @@ category_fields = {
     'description': fields.String
 }
 
+image_derivative_fields = {
+    'name': fields.String,
+    'format': fields.String,
+    'width': fields.Integer,
+    'height': fields.Integer,
+    'url': ImageUrlField(attribute='file_path')
+}
+
 product_image_fields = {
     'id': fields.Integer,
     'product_id': fields.Integer,
     'image_path': fields.String,
     'image_url': ImageUrlField(attribute='image_path'),
     'alt_text': fields.String,
-    'is_primary': fields.Integer
+    'is_primary': fields.Integer,
+    # Resized copies (thumbnail, card, detail) in WebP and JPEG, once generated
+    'derivatives': fields.List(fields.Nested(image_derivative_fields))
 }
 
 product_variant_fields = {
@@ -63,26 +75,195 @@ product_complete_fields = {
     'variants': fields.List(fields.Nested(product_variant_fields))
 }
 
+serialize_product = compile_fields(product_complete_fields)
+
+
+# Query parameters for the paginated listing
+product_list_parser = reqparse.RequestParser()
+product_list_parser.add_argument('limit', type=int, location='args')
+product_list_parser.add_argument('cursor', type=str, location='args')
+product_list_parser.add_argument('sort', type=str, location='args', choices=['id', 'updated_at'], default='id')
+product_list_parser.add_argument('category_id', type=int, location='args')
+product_list_parser.add_argument('is_active', type=int, location='args', choices=[0, 1])
+product_list_parser.add_argument('in_stock', type=int, location='args', choices=[0, 1])
+product_list_parser.add_argument('min_price', type=float, location='args')
+product_list_parser.add_argument('max_price', type=float, location='args')
+
+
+class ProductView:
+    """
+    Product with its images and variants attached as plain lists, so marshal
+    does not fire a query per product through the dynamic relationships.
+    """
+
+    def __init__(self, product, images, variants):
+        self._product = product
+        self.images = images
+        self.variants = variants
+
+    def __getattr__(self, name):
+        return getattr(self._product, name)
+
+
+class ImageView:
+    """Product image with the derivatives of its content attached"""
+
+    def __init__(self, image, derivatives):
+        self._image = image
+        self.derivatives = derivatives
+
+    def __getattr__(self, name):
+        return getattr(self._image, name)
+
+
+def build_product_views(products):
+    """Load images, their derivatives and variants for a page of products with one IN query each"""
+    product_ids = [product.id for product in products]
+    images_by_product = {product_id: [] for product_id in product_ids}
+    variants_by_product = {product_id: [] for product_id in product_ids}
+
+    if product_ids:
+        images = ProductImage.query.filter(
+            ProductImage.product_id.in_(product_ids)
+        ).order_by(ProductImage.id).all()
+        derivatives_by_hash = {}
+        content_hashes = {image.content_hash for image in images if image.content_hash}
+        if content_hashes:
+            derivatives = ImageDerivative.query.filter(
+                ImageDerivative.content_hash.in_(content_hashes)
+            ).all()
+            # Smallest size first; small originals give sizes of equal width
+            derivatives.sort(key=lambda d: (DERIVATIVE_SIZES.get(d.name, 0), d.format))
+            for derivative in derivatives:
+                derivatives_by_hash.setdefault(derivative.content_hash, []).append(derivative)
+
+        for image in images:
+            images_by_product[image.product_id].append(
+                ImageView(image, derivatives_by_hash.get(image.content_hash, []))
+            )
+
+        variants = ProductVariant.query.filter(
+            ProductVariant.product_id.in_(product_ids)
+        ).order_by(ProductVariant.id).all()
+        for variant in variants:
+            variants_by_product[variant.product_id].append(variant)
+
+    return [
+        ProductView(product, images_by_product[product.id], variants_by_product[product.id])
+        for product in products
+    ]
+
+
+def load_product_documents(product_ids):
+    """Build the complete product documents for product_ids, keyed by id"""
+    products = Product.query.options(
+        joinedload(Product.category)
+    ).filter(Product.id.in_(product_ids)).all()
+    return {
+        view.id: serialize_product(view)
+        for view in build_product_views(products)
+    }
+
+
+def _filter_products(query, args):
+    """Apply the storefront filters from the listing query string"""
+    if args['category_id'] is not None:
+        query = query.filter(Product.category_id == args['category_id'])
+    if args['is_active'] is not None:
+        query = query.filter(Product.is_active == args['is_active'])
+
+    # Variant conditions are combined in a single EXISTS so that price range and
+    # in-stock apply to the same variant
+    variant_conditions = []
+    if args['min_price'] is not None:
+        variant_conditions.append(ProductVariant.variant_price >= args['min_price'])
+    if args['max_price'] is not None:
+        variant_conditions.append(ProductVariant.variant_price <= args['max_price'])
+    if args['in_stock'] == 1:
+        variant_conditions.append(ProductVariant.stock_quantity > 0)
+
+    if variant_conditions:
+        query = query.filter(exists().where(and_(
+            ProductVariant.product_id == Product.id,
+            *variant_conditions
+        )))
+    if args['in_stock'] == 0:
+        query = query.filter(~exists().where(and_(
+            ProductVariant.product_id == Product.id,
+            ProductVariant.stock_quantity > 0
+        )))
+    return query
+
+
+def _paginate_products(query, args, limit):
+    """Apply keyset pagination, returning the page and the cursor for the next one"""
+    if args['sort'] == 'updated_at':
+        # Newest first; id breaks ties between rows updated in the same second
+        if args['cursor']:
+            updated_at, last_id = decode_cursor(args['cursor'], 2)
+            query = query.filter(or_(
+                Product.updated_at < updated_at,
+                and_(Product.updated_at == updated_at, Product.id < last_id)
+            ))
+        query = query.order_by(Product.updated_at.desc(), Product.id.desc())
+    else:
+        if args['cursor']:
+            (last_id,) = decode_cursor(args['cursor'], 1)
+            query = query.filter(Product.id > last_id)
+        query = query.order_by(Product.id)
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        if args['sort'] == 'updated_at':
+            next_cursor = encode_cursor(last.updated_at, last.id)
+        else:
+            next_cursor = encode_cursor(last.id)
+    return [row.id for row in rows], next_cursor
+
 
 class ProductCompleteListResource(Resource):
-    """Get all products with images from B2"""
+    """Get products with images from B2, one page at a time"""
     
     def get(self):
-        """Get all products with full data"""
+        """
+        Get a page of products with full data
+
+        Query params:
+        - limit: int (default 20, max 100)
+        - cursor: string (next_cursor from the previous page)
+        - sort: id | updated_at (default id)
+        - category_id: int
+        - is_active: int (0 or 1)
+        - in_stock: int (0 or 1)
+        - min_price / max_price: decimal (variant price range)
+        """
+        args = product_list_parser.parse_args()
+        limit = clamp_limit(args['limit'])
+
         try:
-            products = Product.query.options(
-                joinedload(Product.category),
-                joinedload(Product.images),
-                joinedload(Product.variants)
-            ).all()
-            
-            result = [marshal(product, product_complete_fields) for product in products]
+            # Only the keys are read here; documents come from the product cache
+            query = _filter_products(db.session.query(Product.id, Product.updated_at), args)
+            product_ids, next_cursor = _paginate_products(query, args, limit)
+
+            result = get_product_cache().get_many(product_ids, load_product_documents)
             
             return {
                 'success': True,
                 'count': len(result),
-                'products': result
+                'products': result,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
             }, 200
+        except InvalidCursor as e:
+            abort(400, message=str(e))
+        except HTTPException:
+            raise
         except Exception as e:
             abort(500, message=f"Error fetching products: {str(e)}")
 
@@ -93,23 +274,51 @@ class ProductCompleteResource(Resource):
     def get(self, product_id):
         """Get product by ID with full data"""
         try:
-            product = Product.query.options(
-                joinedload(Product.category),
-                joinedload(Product.images),
-                joinedload(Product.variants)
-            ).get(product_id)
+            product = get_product_cache().get(product_id, load_product_documents)
             
             if not product:
                 abort(404, message=f"Product with id {product_id} not found")
             
             return {
                 'success': True,
-                'product': marshal(product, product_complete_fields)
+                'product': product
             }, 200
+        except HTTPException:
+            raise
         except Exception as e:
             abort(500, message=f"Error fetching product: {str(e)}")
 
 
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+
+def _upload_images(files):
+    """
+    Store the valid image files, uploading only content not stored yet.
+
+    Returns the stored images in request order, each carrying the 'index'
+    of its file in the request, and a list of per-file errors.
+    """
+    candidates = []
+    errors = []
+    for idx, file in enumerate(files):
+        if file.filename == '':
+            continue
+        
+        # Validate extension
+        ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+        if ext not in ALLOWED_EXTENSIONS:
+            errors.append(f"File {file.filename} has invalid extension")
+            continue
+        candidates.append((idx, file))
+    
+    if not candidates:
+        return [], errors
+    
+    stored, upload_errors = store_images(candidates, folder="products")
+    return stored, errors + upload_errors
+
+
 class ProductCreateCompleteResource(Resource):
     """Create product with images and variants"""
     
@@ -139,6 +348,7 @@ class ProductCreateCompleteResource(Resource):
         - variant_stock_quantity[]: int
         - variant_quantity_unit[]: string
         """
+        uploaded_images = []
         try:
             # Get form data
             name = request.form.get('name')
@@ -168,6 +378,14 @@ class ProductCreateCompleteResource(Resource):
             if not category:
                 abort(404, message=f"Category with id {category_id} not found")
             
+            # Upload images before opening the write transaction
+            uploaded_images = []
+            upload_errors = []
+            alt_texts = []
+            if 'images' in request.files:
+                alt_texts = request.form.getlist('alt_text')
+                uploaded_images, upload_errors = _upload_images(request.files.getlist('images'))
+            
             # Create product
             product = Product(
                 name=name,
@@ -181,47 +399,27 @@ class ProductCreateCompleteResource(Resource):
             db.session.add(product)
             db.session.flush()  # Get product ID
             
-            # Handle image uploads
-            uploaded_images = []
-            if 'images' in request.files:
-                storage = get_b2_storage()
-                files = request.files.getlist('images')
-                alt_texts = request.form.getlist('alt_text')
+            # Settles each image's storage path before it is recorded
+            link_images(uploaded_images)
+            for position, upload_result in enumerate(uploaded_images):
+                idx = upload_result['index']
+                
+                # Get alt text for this image
+                alt_text = alt_texts[idx] if idx < len(alt_texts) else None
                 
-                # Validate file types
-                ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+                # First image is primary
+                is_primary = 1 if position == 0 else 0
                 
-                for idx, file in enumerate(files):
-                    if file.filename == '':
-                        continue
-                    
-                    # Check extension
-                    ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-                    if ext not in ALLOWED_EXTENSIONS:
-                        continue
-                    
-                    # Upload to B2
-                    upload_result = storage.upload_file(file, folder="products")
-                    
-                    # Get alt text for this image
-                    alt_text = alt_texts[idx] if idx < len(alt_texts) else None
-                    
-                    # First image is primary
-                    is_primary = 1 if idx == 0 else 0
-                    
-                    # Create database record
-                    product_image = ProductImage(
-                        product_id=product.id,
-                        image_path=upload_result['file_name'],
-                        alt_text=alt_text,
-                        is_primary=is_primary
-                    )
-                    
-                    db.session.add(product_image)
-                    uploaded_images.append({
-                        'file_name': upload_result['file_name'],
-                        'file_url': upload_result['file_url']
-                    })
+                # Create database record
+                product_image = ProductImage(
+                    product_id=product.id,
+                    image_path=upload_result['file_name'],
+                    alt_text=alt_text,
+                    is_primary=is_primary,
+                    content_hash=upload_result['content_hash']
+                )
+                
+                db.session.add(product_image)
             
             # Handle variants
             created_variants = []
@@ -280,20 +478,18 @@ class ProductCreateCompleteResource(Resource):
                             print(f"Error creating variant {idx}: {e}")
             
             db.session.commit()
+            schedule_derivatives(uploaded_images)
             
-            # Reload product with all relationships
-            product = Product.query.options(
-                joinedload(Product.category),
-                joinedload(Product.images),
-                joinedload(Product.variants)
-            ).get(product.id)
+            # Build and cache the product document
+            document = get_product_cache().refresh(product.id, load_product_documents)
             
             return {
                 'success': True,
                 'message': 'Product created successfully',
                 'images_uploaded': len(uploaded_images),
                 'variants_created': len(created_variants),
-                'product': marshal(product, product_complete_fields)
+                'errors': upload_errors,
+                'product': document
             }, 201
             
         except HTTPException:
@@ -301,6 +497,7 @@ class ProductCreateCompleteResource(Resource):
             raise
         except Exception as e:
             db.session.rollback()
+            discard_images(uploaded_images)
             abort(500, message=f"Error creating product: {str(e)}")
 
 
@@ -328,57 +525,47 @@ class ProductUploadImagesResource(Resource):
         if not files or files[0].filename == '':
             abort(400, message="No images selected")
         
+        # Whether the product already has images decides the primary flag
+        has_images = ProductImage.query.filter_by(product_id=product_id).first() is not None
+        
+        alt_texts = request.form.getlist('alt_text')
+        uploaded = []
         try:
-            storage = get_b2_storage()
-            alt_texts = request.form.getlist('alt_text')
+            uploaded, errors = _upload_images(files)
             uploaded_images = []
-            errors = []
+            # Settles each image's storage path before it is recorded
+            link_images(uploaded)
             
-            ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
-            
-            for idx, file in enumerate(files):
-                if file.filename == '':
-                    continue
+            for position, upload_result in enumerate(uploaded):
+                idx = upload_result['index']
+                alt_text = alt_texts[idx] if idx < len(alt_texts) else None
                 
-                # Validate extension
-                ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-                if ext not in ALLOWED_EXTENSIONS:
-                    errors.append(f"File {file.filename} has invalid extension")
-                    continue
+                # The first image of a product becomes its primary image
+                is_primary = 1 if not has_images and position == 0 else 0
                 
-                try:
-                    # Upload to B2
-                    upload_result = storage.upload_file(file, folder="products")
-                    
-                    alt_text = alt_texts[idx] if idx < len(alt_texts) else None
-                    
-                    # Check if this is the first image for the product
-                    existing_images_count = ProductImage.query.filter_by(product_id=product_id).count()
-                    is_primary = 1 if existing_images_count == 0 and idx == 0 else 0
-                    
-                    # Create database record
-                    product_image = ProductImage(
-                        product_id=product_id,
-                        image_path=upload_result['file_name'],
-                        alt_text=alt_text,
-                        is_primary=is_primary
-                    )
-                    
-                    db.session.add(product_image)
-                    db.session.flush()
-                    
-                    uploaded_images.append({
-                        'id': product_image.id,
-                        'image_path': upload_result['file_name'],
-                        'image_url': upload_result['file_url'],
-                        'alt_text': alt_text,
-                        'is_primary': is_primary
-                    })
-                    
-                except Exception as e:
-                    errors.append(f"Failed to upload {file.filename}: {str(e)}")
+                # Create database record
+                product_image = ProductImage(
+                    product_id=product_id,
+                    image_path=upload_result['file_name'],
+                    alt_text=alt_text,
+                    is_primary=is_primary,
+                    content_hash=upload_result['content_hash']
+                )
+                
+                db.session.add(product_image)
+                db.session.flush()
+                
+                uploaded_images.append({
+                    'id': product_image.id,
+                    'image_path': upload_result['file_name'],
+                    'image_url': upload_result['file_url'],
+                    'alt_text': alt_text,
+                    'is_primary': is_primary
+                })
             
             db.session.commit()
+            schedule_derivatives(uploaded)
+            get_product_cache().refresh(product_id, load_product_documents)
             
             return {
                 'success': True,
@@ -389,6 +576,7 @@ class ProductUploadImagesResource(Resource):
             
         except Exception as e:
             db.session.rollback()
+            discard_images(uploaded)
             abort(500, message=f"Error uploading images: {str(e)}")
 
 
@@ -396,20 +584,23 @@ class ProductImageDeleteResource(Resource):
     """Delete product image"""
     
     def delete(self, image_id):
-        """Delete image from database and B2"""
+        """Delete image from database and storage"""
         image = ProductImage.query.get(image_id)
         
         if not image:
             abort(404, message=f"Image with id {image_id} not found")
         
         try:
-            # Delete from B2
-            storage = get_b2_storage()
-            storage.delete_file(image.image_path)
+            # Drop this row's reference; the object goes only when nothing else uses it
+            unreferenced = release_image_rows([image])
             
-            # Delete from database
+            # Delete from database; the storage object is queued in the same
+            # transaction and removed by the deletion worker
+            product_id = image.product_id
             db.session.delete(image)
+            enqueue_storage_deletions(unreferenced)
             db.session.commit()
+            get_product_cache().refresh(product_id, load_product_documents)
             
             return {
                 'success': True,
@@ -485,6 +676,7 @@ class ProductAddVariantsResource(Resource):
                 })
             
             db.session.commit()
+            get_product_cache().refresh(product_id, load_product_documents)
             
             return {
                 'success': True,
@@ -543,19 +735,17 @@ class ProductUpdateResource(Resource):
             product.updated_at = datetime.utcnow()
             db.session.commit()
             
-            # Reload with relationships
-            product = Product.query.options(
-                joinedload(Product.category),
-                joinedload(Product.images),
-                joinedload(Product.variants)
-            ).get(product_id)
+            # Rebuild the cached document for this product only
+            document = get_product_cache().refresh(product_id, load_product_documents)
             
             return {
                 'success': True,
                 'message': 'Product updated successfully',
-                'product': marshal(product, product_complete_fields)
+                'product': document
             }, 200
             
+        except HTTPException:
+            raise
         except Exception as e:
             db.session.rollback()
             abort(500, message=f"Error updating product: {str(e)}")
@@ -567,19 +757,17 @@ class ProductUpdateResource(Resource):
             abort(404, message=f"Product with id {product_id} not found")
         
         try:
-            storage = get_b2_storage()
-            
-            # Delete all images from B2
+            # Release shared image content; legacy images own their object
             images = ProductImage.query.filter_by(product_id=product_id).all()
-            for image in images:
-                try:
-                    storage.delete_file(image.image_path)
-                except:
-                    pass  # Continue even if B2 delete fails
+            unreferenced = release_image_rows(images)
+            ProductImage.query.filter_by(product_id=product_id).delete()
             
-            # Delete from database (cascade will handle related records)
+            # Delete from database (cascade will handle related records) and
+            # queue the unreferenced images for the deletion worker
             db.session.delete(product)
+            enqueue_storage_deletions(unreferenced)
             db.session.commit()
+            get_product_cache().invalidate(product_id)
             
             return {
                 'success': True,
@@ -2,6 +2,7 @@ from flask_restful import Resource, reqparse, fields, marshal_with
 from models.promotion import Promotion
 from extensions import db
 from datetime import datetime
+from utils.promotion_index import get_promotion_index
 
 promotion_fields = {
     'id': fields.Integer,
@@ -42,6 +43,7 @@ class PromotionListResource(Resource):
         promotion = Promotion(**args)
         db.session.add(promotion)
         db.session.commit()
+        get_promotion_index().refresh(promotion.id)
         return promotion, 201
 
 class PromotionResource(Resource):
@@ -62,10 +64,12 @@ class PromotionResource(Resource):
             if value is not None:
                 setattr(promotion, key, value)
         db.session.commit()
+        get_promotion_index().refresh(promotion.id)
         return promotion
     
     def delete(self, id):
         promotion = Promotion.query.get_or_404(id)
         db.session.delete(promotion)
         db.session.commit()
+        get_promotion_index().refresh(id)
         return {'message': 'Promotion deleted'}, 204
@@ -1,6 +1,8 @@
 from flask_restful import Resource, reqparse, fields, marshal_with, abort
 from models.user import User
 from extensions import db
+from utils.cart_ops import merge_guest_cart, bump_cart_version
+from utils.pricing import price_cart
 
 user_fields = {
     'id': fields.Integer,
@@ -75,6 +77,8 @@ class UserResource(Resource):
 login_parser = reqparse.RequestParser()
 login_parser.add_argument('email', type=str, required=True)
 login_parser.add_argument('password', type=str, required=True)
+# Token of a guest cart to merge into the user's cart
+login_parser.add_argument('guest_token', type=str)
 
 class LoginResource(Resource):
     def post(self):
@@ -82,8 +86,17 @@ class LoginResource(Resource):
         user = User.query.filter_by(email=args['email']).first()
         if not user or not user.check_password(args['password']):
             abort(401, message='Invalid credentials')
-        return {
+        response = {
             'message': 'Login successful',
             'user_id': user.id,
             'role': user.role
-        }, 200
+        }
+        if args.get('guest_token'):
+            # Fold the guest cart into the user's cart and price it once
+            cart = merge_guest_cart(args['guest_token'], user.id)
+            if cart is not None:
+                price_cart(cart)
+                bump_cart_version(cart)
+                response['cart_id'] = cart.id
+                db.session.commit()
+        return response, 200
@@ -1,13 +1,58 @@
+import io
 import os
-import hashlib
-import mimetypes
-from datetime import datetime
-from b2sdk.v2 import InMemoryAccountInfo, B2Api
-from werkzeug.utils import secure_filename
+import time
+import threading
+from b2sdk.v2 import InMemoryAccountInfo, B2Api, UploadSourceStream
+from b2sdk.v2.exception import FileNotPresent
+from utils.storage import StorageBackend
 
-class B2Storage:
+
+class _StreamView(io.IOBase):
+    """
+    Read-only view of an upload stream with its own position.
+
+    b2sdk opens one view per part and may read parts of a large file from
+    several threads; each read seeks the shared stream under a lock. Closing
+    a view leaves the underlying (spooled) request file open.
+    """
+    
+    def __init__(self, stream, lock):
+        self._stream = stream
+        self._lock = lock
+        self._position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def read(self, size=-1):
+        with self._lock:
+            self._stream.seek(self._position)
+            data = self._stream.read(size)
+        self._position += len(data)
+        return data
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            with self._lock:
+                self._position = self._stream.seek(offset, io.SEEK_END)
+        return self._position
+    
+    def tell(self):
+        return self._position
+
+
+class B2Storage(StorageBackend):
     """Backblaze B2 Storage Handler"""
     
+    name = 'b2'
+    
     def __init__(self):
         # Get credentials from environment
         self.application_key_id = os.getenv('B2_KEY_ID')
@@ -17,72 +62,60 @@ class B2Storage:
         if not all([self.application_key_id, self.application_key, self.bucket_name]):
             raise ValueError("B2 credentials not found in environment variables")
         
-        # Initialize B2 API
+        # Authorization happens on first use, not at startup or import
+        self.auth_ttl = int(os.getenv('B2_AUTH_TTL', str(23 * 3600)))
+        self.b2_api = None
+        self._bucket = None
+        self._authorized_at = None
+        self._auth_lock = threading.Lock()
+    
+    def _authorize(self):
         info = InMemoryAccountInfo()
-        self.b2_api = B2Api(info)
-        self.b2_api.authorize_account("production", self.application_key_id, self.application_key)
-        
-        # Get bucket
-        self.bucket = self.b2_api.get_bucket_by_name(self.bucket_name)
+        b2_api = B2Api(info)
+        b2_api.authorize_account("production", self.application_key_id, self.application_key)
+        self._bucket = b2_api.get_bucket_by_name(self.bucket_name)
+        self.b2_api = b2_api
+        self._authorized_at = time.monotonic()
     
-    def get_file_url(self, file_path):
-        """Get public URL for a file"""
-        if not file_path:
-            return None
-        # Use the download URL format
-        return f"https://f002.backblazeb2.com/file/{self.bucket_name}/{file_path}"
+    @property
+    def bucket(self):
+        """
+        Authorized bucket handle. B2 account tokens expire after 24 hours, so
+        the account is re-authorized once auth_ttl has passed; b2sdk also
+        retries a call once with a fresh token if one expires early.
+        """
+        if self._bucket is None or time.monotonic() - self._authorized_at > self.auth_ttl:
+            with self._auth_lock:
+                if self._bucket is None or time.monotonic() - self._authorized_at > self.auth_ttl:
+                    self._authorize()
+        return self._bucket
     
-    def generate_unique_filename(self, original_filename):
-        """Generate unique filename"""
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        random_hash = hashlib.md5(f"{original_filename}{timestamp}".encode()).hexdigest()[:8]
-        name, ext = os.path.splitext(secure_filename(original_filename))
-        return f"{timestamp}_{random_hash}_{name}{ext}"
+    def _put(self, stream, file_path, content_type, size, sha1):
+        # b2sdk reads the stream in chunks and switches to a multipart
+        # large-file upload for big objects
+        stream_lock = threading.Lock()
+        upload_source = UploadSourceStream(
+            lambda: _StreamView(stream, stream_lock),
+            stream_length=size,
+            stream_sha1=sha1
+        )
+        
+        # Upload to B2
+        file_info = self.bucket.upload(
+            upload_source,
+            file_path,
+            content_type=content_type
+        )
+        return file_info.id_
     
-    def upload_file(self, file, folder="products"):
-        """Upload file to B2 storage"""
-        try:
-            unique_filename = self.generate_unique_filename(file.filename)
-            file_path = f"{folder}/{unique_filename}"
-            content_type = file.content_type or mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
-            
-            # Read file data
-            file_data = file.read()
-            file.seek(0)  # Reset file pointer
-            
-            # Upload to B2
-            file_info = self.bucket.upload_bytes(
-                data_bytes=file_data,
-                file_name=file_path,
-                content_type=content_type
-            )
-            
-            return {
-                'file_name': file_path,
-                'file_url': self.get_file_url(file_path),
-                'file_id': file_info.id_,
-                'content_type': content_type,
-                'size': len(file_data)
-            }
-        except Exception as e:
-            raise Exception(f"Failed to upload file: {str(e)}")
+    def _get(self, file_path):
+        buffer = io.BytesIO()
+        self.bucket.download_file_by_name(file_path).save(buffer)
+        return buffer.getvalue()
     
-    def delete_file(self, file_name):
-        """Delete file from B2"""
+    def _delete(self, file_path):
         try:
-            file_version = self.bucket.get_file_info_by_name(file_name)
-            self.b2_api.delete_file_version(file_version.id_, file_name)
-            return True
-        except Exception as e:
-            print(f"Warning: Could not delete file {file_name}: {str(e)}")
-            return False
-
-# Initialize global instance
-b2_storage = None
-
-def get_b2_storage():
-    """Get or create B2Storage instance"""
-    global b2_storage
-    if b2_storage is None:
-        b2_storage = B2Storage()
-    return b2_storage
\ No newline at end of file
+            file_version = self.bucket.get_file_info_by_name(file_path)
+        except FileNotPresent:
+            return
+        self.b2_api.delete_file_version(file_version.id_, file_path)
@@ -0,0 +1,51 @@
+import threading
+import traceback
+
+
+class PeriodicWorker:
+    """
+    Runs a job every `interval` seconds on a daemon thread inside an app context.
+
+    The job returns how much work it did; a truthy result runs it again straight
+    away so a backlog drains without waiting for the next tick. Exceptions are
+    printed and the worker carries on at the next tick.
+    """
+
+    def __init__(self, app, name, job, interval):
+        self.app = app
+        self.name = name
+        self.job = job
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self):
+        with self.app.app_context():
+            return self.job()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.run_once()
+            except Exception:
+                print(f"Warning: background job {self.name} failed")
+                traceback.print_exc()
+                busy = False
+            if not busy:
+                self._stop.wait(self.interval)
+
+
+def start_periodic_worker(app, name, job, interval):
+    """Start a PeriodicWorker running job() every interval seconds"""
+    return PeriodicWorker(app, name, job, interval).start()
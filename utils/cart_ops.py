@@ -0,0 +1,247 @@
+import secrets
+from datetime import datetime
+from sqlalchemy import delete, update, select, literal
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.mysql import insert
+from extensions import db
+from models.cart import Cart
+from models.cart_item import CartItem
+
+
+def get_or_create_cart(user_id):
+    """
+    Return the user's cart, creating it if needed, in the caller's transaction.
+
+    Creation is an upsert on the unique user_id, so concurrent first adds for
+    the same user end up with one cart instead of a duplicate-key error.
+    """
+    cart = Cart.query.filter_by(user_id=user_id).first()
+    if cart is not None:
+        return cart
+    now = datetime.utcnow()
+    stmt = insert(Cart).values(
+        user_id=user_id,
+        coupon_active=0,
+        coupon_discount=0,
+        dicounted_total_price=0,
+        actual_amount=0,
+        updated_at=now
+    )
+    db.session.execute(stmt.on_duplicate_key_update(user_id=stmt.inserted.user_id))
+    return Cart.query.filter_by(user_id=user_id).first()
+
+
+def create_guest_cart():
+    """Create an anonymous cart keyed by a new random token, in the caller's transaction"""
+    cart = Cart(guest_token=secrets.token_urlsafe(32), coupon_active=0, version=0)
+    db.session.add(cart)
+    db.session.flush()
+    return cart
+
+
+def merge_cart_items(source_cart_id, target_cart_id):
+    """
+    Fold every line of one cart into another with a single
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE: variants missing from the
+    target are copied and variants in both have their quantities added.
+    """
+    source = aliased(CartItem, name='source_items')
+    now = datetime.utcnow()
+    lines = select(
+        literal(target_cart_id),
+        source.product_variant_id,
+        source.quantity,
+        source.product_actual_price,
+        literal(0),
+        literal(0),
+        literal(now)
+    ).where(source.cart_id == source_cart_id).order_by(source.product_variant_id)
+    stmt = insert(CartItem).from_select(
+        ['cart_id', 'product_variant_id', 'quantity', 'product_actual_price',
+         'promotion_discount', 'After_discounted_total', 'updated_at'],
+        lines
+    )
+    stmt = stmt.on_duplicate_key_update(
+        quantity=CartItem.quantity + stmt.inserted.quantity,
+        updated_at=stmt.inserted.updated_at
+    )
+    db.session.execute(stmt)
+
+
+def merge_guest_cart(guest_token, user_id):
+    """
+    Move a guest cart into the user's cart, in the caller's transaction.
+
+    The guest cart row is locked so concurrent logins with the same token
+    merge it once. Lines are folded in with one statement, the guest coupon is
+    kept when the user's cart has none, and the guest cart is deleted.
+    Returns the user's cart, or None when there is no such guest cart.
+    """
+    guest = Cart.query.filter_by(guest_token=guest_token).with_for_update().first()
+    if guest is None:
+        return None
+    cart = get_or_create_cart(user_id)
+    merge_cart_items(guest.id, cart.id)
+    if guest.coupon_active and not cart.coupon_active:
+        cart.coupon_active = guest.coupon_active
+        cart.coupon_id = guest.coupon_id
+        cart.coupon_code = guest.coupon_code
+    db.session.execute(delete(CartItem).where(CartItem.cart_id == guest.id))
+    db.session.execute(delete(Cart).where(Cart.id == guest.id), execution_options={'synchronize_session': False})
+    db.session.expunge(guest)
+    return cart
+
+
+class CartVersionConflict(Exception):
+    """The cart changed since the version the client last read"""
+
+
+def cart_etag(version):
+    """ETag value for a cart version"""
+    return f'"{version}"'
+
+
+def bump_cart_version(cart, expected_version=None):
+    """
+    Increment the cart's version and updated_at, in the caller's transaction.
+
+    With expected_version this is a compare-and-swap: the UPDATE only matches
+    while the stored version is still the expected one, and
+    CartVersionConflict is raised otherwise. Without it the version is
+    incremented unconditionally. Call it last, right before the commit, so
+    the cart row is locked only briefly.
+    """
+    stmt = update(Cart).where(Cart.id == cart.id)
+    if expected_version is not None:
+        stmt = stmt.where(Cart.version == expected_version)
+    now = datetime.utcnow()
+    stmt = stmt.values(version=Cart.version + 1, updated_at=now)
+    result = db.session.execute(stmt, execution_options={'synchronize_session': False})
+    if result.rowcount == 0:
+        raise CartVersionConflict(f"Cart {cart.id} was modified by another request")
+    if expected_version is not None:
+        set_committed_value(cart, 'version', expected_version + 1)
+        set_committed_value(cart, 'updated_at', now)
+    else:
+        db.session.expire(cart, ['version', 'updated_at'])
+
+
+def upsert_cart_items(cart_id, lines, increment=True):
+    """
+    Write cart lines with one multi-row INSERT ... ON DUPLICATE KEY UPDATE on
+    (cart_id, product_variant_id). `lines` are (product_variant_id, quantity,
+    unit_price); existing lines have their quantity incremented, or replaced
+    when increment is False. Prices and totals are left to the pricing engine.
+    """
+    if not lines:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {
+            'cart_id': cart_id,
+            'product_variant_id': product_variant_id,
+            'quantity': quantity,
+            'product_actual_price': unit_price,
+            'promotion_discount': 0,
+            'After_discounted_total': 0,
+            'updated_at': now
+        }
+        # Sorted so concurrent writers lock lines in the same order
+        for product_variant_id, quantity, unit_price in sorted(lines, key=lambda line: line[0])
+    ]
+    stmt = insert(CartItem).values(rows)
+    if increment:
+        quantity = CartItem.quantity + stmt.inserted.quantity
+    else:
+        quantity = stmt.inserted.quantity
+    db.session.execute(stmt.on_duplicate_key_update(quantity=quantity, updated_at=stmt.inserted.updated_at))
+
+
+def add_cart_item(cart_id, product_variant_id, quantity, unit_price):
+    """
+    Add quantity of a variant to a cart with a single upsert: a new line is
+    created, or the existing line's quantity is incremented in place.
+    """
+    upsert_cart_items(cart_id, [(product_variant_id, quantity, unit_price)])
+
+
+def remove_cart_items(cart_id, product_variant_ids):
+    """Delete the lines for product_variant_ids from a cart with one statement"""
+    if not product_variant_ids:
+        return
+    db.session.execute(
+        delete(CartItem).where(
+            CartItem.cart_id == cart_id,
+            CartItem.product_variant_id.in_(sorted(product_variant_ids))
+        )
+    )
+
+
+class CartOperationError(ValueError):
+    """A batch cart operation that cannot be applied"""
+
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+# Operations that give the same cart when a request is repeated, as PUT needs
+IDEMPOTENT_CART_OPERATIONS = ('set', 'remove')
+MAX_CART_OPERATIONS = 200
+
+
+def fold_cart_operations(operations, allowed=CART_OPERATIONS):
+    """
+    Reduce a list of {"op", "product_variant_id", "quantity"} operations, in
+    order, to one final action per variant: ('add', n), ('set', n) or
+    ('remove', None). Setting a quantity of 0 removes the line. Only ops in
+    `allowed` are accepted.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError("operations must be a non-empty list")
+    if len(operations) > MAX_CART_OPERATIONS:
+        raise CartOperationError(f"At most {MAX_CART_OPERATIONS} operations are allowed per request")
+
+    actions = {}
+    for position, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise CartOperationError(f"Operation {position} must be an object")
+        op = operation.get('op')
+        variant_id = operation.get('product_variant_id')
+        quantity = operation.get('quantity', 1 if op == 'add' else None)
+        if op not in allowed:
+            raise CartOperationError(f"Operation {position}: op must be one of {', '.join(allowed)}")
+        if not isinstance(variant_id, int) or isinstance(variant_id, bool):
+            raise CartOperationError(f"Operation {position}: product_variant_id must be an integer")
+        if op != 'remove' and (not isinstance(quantity, int) or isinstance(quantity, bool)):
+            raise CartOperationError(f"Operation {position}: quantity must be an integer")
+        if op == 'add' and quantity < 1:
+            raise CartOperationError(f"Operation {position}: quantity must be at least 1")
+        if op == 'set' and quantity < 0:
+            raise CartOperationError(f"Operation {position}: quantity cannot be negative")
+
+        previous = actions.get(variant_id)
+        if op == 'remove' or (op == 'set' and quantity == 0):
+            actions[variant_id] = ('remove', None)
+        elif op == 'set':
+            actions[variant_id] = ('set', quantity)
+        elif previous is None or previous[0] == 'add':
+            actions[variant_id] = ('add', quantity + (previous[1] if previous else 0))
+        elif previous[0] == 'set':
+            actions[variant_id] = ('set', previous[1] + quantity)
+        else:
+            # Adding after a remove starts the line again
+            actions[variant_id] = ('set', quantity)
+    return actions
+
+
+def apply_cart_operations(cart_id, actions, prices):
+    """
+    Apply folded actions to a cart with set-based statements: one DELETE for
+    removals, one upsert for set quantities and one for increments. `prices`
+    maps every added or set variant to its unit price.
+    """
+    removals = [variant_id for variant_id, (action, _) in actions.items() if action == 'remove']
+    sets = [(variant_id, quantity, prices[variant_id]) for variant_id, (action, quantity) in actions.items() if action == 'set']
+    adds = [(variant_id, quantity, prices[variant_id]) for variant_id, (action, quantity) in actions.items() if action == 'add']
+    remove_cart_items(cart_id, removals)
+    upsert_cart_items(cart_id, sets, increment=False)
+    upsert_cart_items(cart_id, adds)
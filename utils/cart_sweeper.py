@@ -0,0 +1,65 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from extensions import db
+from models.cart import Cart
+from models.cart_item import CartItem
+from utils.background import start_periodic_worker
+
+
+def cart_ttl_days():
+    """Days after its last change that a cart is deleted, or None when carts never expire"""
+    value = os.getenv('CART_TTL_DAYS')
+    return int(value) if value else None
+
+
+def sweep_cart_batch(ttl_days, batch_size=None):
+    """
+    Delete one batch of carts not changed for ttl_days, with their items.
+
+    The batch is the oldest carts in (updated_at, id) order, locked with
+    SKIP LOCKED so carts being written right now are left for a later pass.
+    Items and carts are deleted by id in one short transaction. Returns the
+    number of carts deleted.
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv('CART_SWEEP_BATCH', '500'))
+    cutoff = datetime.utcnow() - timedelta(days=ttl_days)
+
+    cart_ids = [
+        cart_id for (cart_id,) in
+        db.session.query(Cart.id)
+        .filter(Cart.updated_at < cutoff)
+        .order_by(Cart.updated_at, Cart.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ]
+    if not cart_ids:
+        db.session.commit()
+        return 0
+
+    db.session.execute(delete(CartItem).where(CartItem.cart_id.in_(cart_ids)))
+    db.session.execute(delete(Cart).where(Cart.id.in_(cart_ids)))
+    db.session.commit()
+    return len(cart_ids)
+
+
+def sweep_abandoned_carts(ttl_days=None, batch_size=None):
+    """Delete every expired cart batch by batch, returning how many were deleted"""
+    ttl_days = ttl_days if ttl_days is not None else cart_ttl_days()
+    if ttl_days is None:
+        return 0
+    total = 0
+    while True:
+        deleted = sweep_cart_batch(ttl_days, batch_size)
+        if not deleted:
+            return total
+        total += deleted
+
+
+def start_cart_sweeper(app, interval=None):
+    """Sweep expired carts on a background thread of this process"""
+    ttl_days = cart_ttl_days()
+    if interval is None:
+        interval = float(os.getenv('CART_SWEEP_INTERVAL', '3600'))
+    return start_periodic_worker(app, 'cart-sweeper', lambda: sweep_cart_batch(ttl_days), interval)
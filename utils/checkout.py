@@ -0,0 +1,103 @@
+from datetime import datetime
+from sqlalchemy import insert, delete
+from extensions import db
+from models.cart import Cart
+from models.cart_item import CartItem
+from models.order import Order
+from models.order_item import OrderItem
+from utils.pricing import price_cart, ZERO
+from utils.inventory import hold_stock, short_stock
+from utils.coupon_ops import claim_coupon
+from utils.cart_ops import bump_cart_version
+
+
+class CheckoutError(ValueError):
+    """The cart cannot be turned into an order"""
+
+
+class OutOfStock(CheckoutError):
+    """Some cart lines ask for more than is in stock"""
+
+    def __init__(self, variant_ids):
+        self.variant_ids = variant_ids
+        super().__init__(f"Not enough stock for product variants: {', '.join(map(str, variant_ids))}")
+
+
+def lock_user_cart(user_id):
+    """The user's cart, locked until the transaction ends, or None"""
+    return Cart.query.filter_by(user_id=user_id).with_for_update().first()
+
+
+def checkout_cart(cart, address_id, expected_version=None, now=None):
+    """
+    Turn a locked cart into an order, in the caller's transaction.
+
+    The cart is repriced, the order and all its items are inserted (items
+    with one multi-row INSERT), stock is held for the order with one
+    conditional UPDATE, the applied coupon use is claimed for the order, and
+    the cart is emptied with its version bumped. Raises CheckoutError,
+    OutOfStock, CouponUnavailable or CartVersionConflict, after which the
+    caller must roll back. Returns the order, its items and when the stock
+    hold expires.
+    """
+    now = now or datetime.utcnow()
+    pricing = price_cart(cart, now)
+    lines = [(item, pricing.variants.get(item.product_variant_id)) for item in pricing.items if item.quantity > 0]
+    if not lines:
+        raise CheckoutError("Cart is empty")
+    missing = [item.product_variant_id for item, variant in lines if variant is None]
+    if missing:
+        raise OutOfStock(missing)
+
+    promotion_discount = sum((item.promotion_discount or ZERO for item, _ in lines), ZERO)
+    coupon = pricing.coupon if cart.coupon_discount else None
+    discount_sources = [
+        source for source, applied in (('promotion', promotion_discount), ('coupon', coupon)) if applied
+    ]
+    order = Order(
+        user_id=cart.user_id,
+        address_id=address_id,
+        sub_total=cart.actual_amount,
+        discount_amount=promotion_discount + (cart.coupon_discount or ZERO),
+        discount_source=','.join(discount_sources) or None,
+        actual_amount=cart.dicounted_total_price,
+        payment_status='pending',
+        order_status='pending',
+        created_at=now
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    quantities = {item.product_variant_id: item.quantity for item, _ in lines}
+    hold_expires_at = hold_stock(order.id, quantities, now)
+    if hold_expires_at is None:
+        # Rows with enough stock were reserved; read the others after
+        # undoing that
+        db.session.rollback()
+        raise OutOfStock(short_stock(quantities))
+
+    db.session.execute(insert(OrderItem).values([
+        {
+            'order_id': order.id,
+            'product_id': variant.product_id,
+            'product_variant_id': variant.id,
+            'quantity': item.quantity,
+            'price': item.product_actual_price
+        }
+        for item, variant in lines
+    ]))
+    if coupon is not None:
+        claim_coupon(coupon.id, cart.user_id, order.id, now)
+
+    db.session.execute(delete(CartItem).where(CartItem.cart_id == cart.id))
+    cart.coupon_active = 0
+    cart.coupon_id = None
+    cart.coupon_code = None
+    cart.coupon_discount = 0
+    cart.actual_amount = 0
+    cart.dicounted_total_price = 0
+    db.session.flush()
+    bump_cart_version(cart, expected_version)
+
+    items = OrderItem.query.filter_by(order_id=order.id).order_by(OrderItem.id).all()
+    return order, items, hold_expires_at
@@ -0,0 +1,100 @@
+import os
+from sqlalchemy import select, func, literal
+from extensions import db
+from models.coupon import Coupon, coupon_code_key
+from models.coupon_user import CouponUser
+from utils.cache import LRUCache
+from utils.pricing import to_decimal, is_live
+
+
+class CouponEntry:
+    """Snapshot of a coupon and one user's uses of it, safe to share across requests"""
+
+    __slots__ = ('id', 'code', 'discount_type', 'discount_values', 'min_order_value', 'usage_limit',
+                 'used_count', 'per_user_limit', 'start_date', 'end_date', 'is_active', 'user_uses')
+
+    def __init__(self, coupon, user_uses):
+        self.id = coupon.id
+        self.code = coupon.code
+        self.discount_type = coupon.discount_type
+        self.discount_values = coupon.discount_values
+        self.min_order_value = coupon.min_order_value or 0
+        self.usage_limit = coupon.usage_limit
+        self.used_count = coupon.used_count or 0
+        self.per_user_limit = coupon.per_user_limit
+        self.start_date = coupon.start_date
+        self.end_date = coupon.end_date
+        self.is_active = coupon.is_active
+        self.user_uses = user_uses
+
+    def rejection(self, order_value, now):
+        """Why the coupon cannot be used for an order of order_value now, or None if it can"""
+        if self.is_active != 1:
+            return 'inactive'
+        if not is_live(self.start_date, self.end_date, now):
+            return 'expired' if self.end_date is not None and now > self.end_date else 'not_started'
+        if self.usage_limit is not None and self.used_count >= self.usage_limit:
+            return 'used_up'
+        if self.per_user_limit is not None and self.user_uses >= self.per_user_limit:
+            return 'user_limit_reached'
+        if order_value is not None and to_decimal(self.min_order_value) > order_value:
+            return 'min_order_value'
+        return None
+
+
+class CouponLookupCache:
+    """
+    Short-lived cache of coupon lookups by (code key, user id), holding
+    unknown codes too, so repeated or guessed codes do not reach the
+    database. A miss costs one indexed query for the coupon and the user's
+    uses. Cached counts may lag redemptions by up to `ttl` seconds, which
+    only affects validation; redemption enforces the limits itself.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.ttl = ttl
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def _load(self, code_key, user_id):
+        if user_id is None:
+            user_uses = literal(0)
+        else:
+            user_uses = (
+                select(func.count(CouponUser.id))
+                .where(CouponUser.coupon_id == Coupon.id, CouponUser.user_id == user_id)
+                .scalar_subquery()
+            )
+        row = db.session.execute(
+            select(Coupon, user_uses).where(Coupon.code_key == code_key)
+        ).first()
+        return CouponEntry(row[0], row[1] or 0) if row else None
+
+    def lookup(self, code, user_id=None):
+        """The CouponEntry for a code as seen by user_id, or None for an unknown code"""
+        key = (coupon_code_key(code), user_id)
+        if self.ttl <= 0:
+            return self._load(*key)
+        found = self.entries.get(key, False)
+        if found is not False:
+            return found
+        entry = self._load(key[0], user_id)
+        self.entries.set(key, entry)
+        return entry
+
+    def clear(self):
+        """Drop every lookup; call after coupons are created, changed or deleted"""
+        self.entries.clear()
+
+
+# Initialize global instance
+coupon_cache = None
+
+def get_coupon_cache():
+    """Get or create the process-wide coupon lookup cache"""
+    global coupon_cache
+    if coupon_cache is None:
+        coupon_cache = CouponLookupCache(
+            maxsize=int(os.getenv('COUPON_CACHE_SIZE', '10000')),
+            ttl=int(os.getenv('COUPON_CACHE_TTL', '30'))
+        )
+    return coupon_cache
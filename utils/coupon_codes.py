@@ -0,0 +1,69 @@
+import secrets
+from sqlalchemy import insert, select
+from extensions import db
+from models.coupon import Coupon, coupon_code_key
+
+# Upper-case letters and digits without the look-alikes 0/O and 1/I;
+# 32 symbols, so a random byte maps to one without bias
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+_BYTE_TO_SYMBOL = bytes(ord(CODE_ALPHABET[value % len(CODE_ALPHABET)]) for value in range(256))
+
+BULK_COUPON_BATCH = 1000
+BULK_COUPON_MAX = 1000000
+
+
+def random_codes(count, length, prefix=''):
+    """`count` random codes of `length` symbols after `prefix`, possibly repeating"""
+    symbols = secrets.token_bytes(count * length).translate(_BYTE_TO_SYMBOL).decode('ascii')
+    return [prefix + symbols[start:start + length] for start in range(0, count * length, length)]
+
+
+def code_space_fits(count, length):
+    """Whether codes of `length` symbols leave room for `count` codes with rare collisions"""
+    return len(CODE_ALPHABET) ** length >= count * 1000
+
+
+def _insert_batch(codes, template):
+    """
+    Insert one batch of new coupons with a single multi-row INSERT, after
+    one indexed query for codes that already exist. Returns the codes
+    that were taken, which the caller replaces.
+    """
+    keys = {code: coupon_code_key(code) for code in codes}
+    taken_keys = set(db.session.execute(
+        select(Coupon.code_key).where(Coupon.code_key.in_(list(keys.values())))
+    ).scalars())
+    rows = [
+        dict(template, code=code, code_key=key, used_count=0)
+        for code, key in keys.items()
+        if key not in taken_keys
+    ]
+    if rows:
+        db.session.execute(insert(Coupon), rows)
+    db.session.commit()
+    return [code for code, key in keys.items() if key in taken_keys]
+
+
+def generate_coupons(count, template, length=10, prefix='', batch_size=BULK_COUPON_BATCH):
+    """
+    Create `count` coupons sharing the `template` columns, each with a new
+    random code, yielding every batch of codes once it is committed.
+
+    Codes are unique within the job by construction and checked against
+    existing coupons per batch; colliding codes are replaced by new ones.
+    """
+    prefix = (prefix or '').strip().upper()
+    seen = set()
+    remaining = count
+    while remaining:
+        batch = []
+        while len(batch) < min(batch_size, remaining):
+            for code in random_codes(min(batch_size, remaining) - len(batch), length, prefix):
+                if code not in seen:
+                    seen.add(code)
+                    batch.append(code)
+        taken = set(_insert_batch(batch, template))
+        created = [code for code in batch if code not in taken]
+        remaining -= len(created)
+        if created:
+            yield created
@@ -0,0 +1,96 @@
+from datetime import datetime
+from sqlalchemy import select, update, delete, func, case, or_
+from extensions import db
+from models.coupon import Coupon
+from models.coupon_user import CouponUser
+
+
+class CouponUnavailable(ValueError):
+    """The coupon does not exist, is inactive or outside its window, or is used up"""
+
+
+def claim_coupon(coupon_id, user_id, order_id=None, now=None):
+    """
+    Claim one use of a coupon for a user, in the caller's transaction.
+
+    The limits are enforced by a single conditional UPDATE, so concurrent
+    claims never overshoot usage_limit and no read of the counter is needed;
+    the coupon row stays locked only until the caller commits, so commit
+    right away. Records and returns the Coupon_Code_Users row, or raises
+    CouponUnavailable.
+    """
+    now = now or datetime.utcnow()
+    used_count = func.coalesce(Coupon.used_count, 0)
+    user_uses = (
+        select(func.count(CouponUser.id))
+        .where(CouponUser.coupon_id == Coupon.id, CouponUser.user_id == user_id)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        update(Coupon)
+        .where(
+            Coupon.id == coupon_id,
+            Coupon.is_active == 1,
+            Coupon.start_date <= now,
+            Coupon.end_date >= now,
+            or_(Coupon.usage_limit.is_(None), used_count < Coupon.usage_limit),
+            or_(Coupon.per_user_limit.is_(None), user_uses < Coupon.per_user_limit)
+        )
+        .values(used_count=used_count + 1),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount == 0:
+        raise CouponUnavailable(f"Coupon {coupon_id} is not available")
+    redemption = CouponUser(coupon_id=coupon_id, user_id=user_id, order_id=order_id, created_at=now)
+    db.session.add(redemption)
+    db.session.flush()
+    return redemption
+
+
+def _release(redemptions):
+    """Give back the uses of redemption rows: one UPDATE per coupon and one DELETE"""
+    if not redemptions:
+        return 0
+    counts = {}
+    for coupon_id, _ in redemptions:
+        counts[coupon_id] = counts.get(coupon_id, 0) + 1
+    used_count = func.coalesce(Coupon.used_count, 0)
+    for coupon_id, count in counts.items():
+        db.session.execute(
+            update(Coupon)
+            .where(Coupon.id == coupon_id)
+            .values(used_count=case((used_count > count, used_count - count), else_=0)),
+            execution_options={'synchronize_session': False}
+        )
+    db.session.execute(
+        delete(CouponUser).where(CouponUser.id.in_([redemption_id for _, redemption_id in redemptions])),
+        execution_options={'synchronize_session': False}
+    )
+    return len(redemptions)
+
+
+def release_coupon(redemption_id):
+    """Release one redemption, in the caller's transaction. Returns False if it does not exist"""
+    redemptions = (
+        db.session.query(CouponUser.coupon_id, CouponUser.id)
+        .filter(CouponUser.id == redemption_id)
+        .with_for_update()
+        .all()
+    )
+    return _release(redemptions) > 0
+
+
+def release_order_coupons(order_ids):
+    """
+    Release every coupon use redeemed for the given orders, in the caller's
+    transaction. Returns the number of uses released.
+    """
+    if not order_ids:
+        return 0
+    redemptions = (
+        db.session.query(CouponUser.coupon_id, CouponUser.id)
+        .filter(CouponUser.order_id.in_(list(order_ids)))
+        .with_for_update()
+        .all()
+    )
+    return _release(redemptions)
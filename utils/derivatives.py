@@ -0,0 +1,245 @@
+import io
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.dialects.mysql import insert
+from werkzeug.datastructures import FileStorage
+from extensions import db
+from models.stored_image import StoredImage
+from models.image_derivative import ImageDerivative
+from models.product_image import ProductImage
+from utils.storage import get_storage
+from utils.storage_deletions import enqueue_storage_deletions
+from utils.product_cache import get_product_cache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images are then served as uploaded
+    Image = None
+
+# Longest edge in pixels of each derivative; smaller originals are not upscaled
+DERIVATIVE_SIZES = {'thumbnail': 160, 'card': 480, 'detail': 1200}
+# Output format -> (Pillow format, content type, file extension)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+}
+DERIVATIVE_QUALITY = 80
+DERIVATIVE_FOLDER = 'products/derivatives'
+
+
+def derivative_file_name(file_path, name, format):
+    """
+    Storage name of one derivative, inside DERIVATIVE_FOLDER. It is named
+    after the original's unique object name, so derivatives of content that
+    was released and uploaded again never reuse a deleted name.
+    """
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return f"{stem}_{name}.{DERIVATIVE_FORMATS[format][2]}"
+
+
+def _flatten(image):
+    """RGB copy of an image, with transparency composited onto white for JPEG"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_derivatives(data):
+    """
+    Render every size and format of one image. Runs in a worker process.
+
+    Sizes are produced largest first, each resized from the previous one, and
+    JPEG sources are decoded at reduced scale when they are much larger than
+    the biggest derivative. Returns a list of dicts with 'name', 'format',
+    'content_type', 'width', 'height' and the encoded 'data'.
+    """
+    image = Image.open(io.BytesIO(data))
+    largest = max(DERIVATIVE_SIZES.values())
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    renders = []
+    current = image
+    for name, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        current = current.copy()
+        current.thumbnail((size, size), Image.LANCZOS)
+        for format, (pil_format, content_type, _) in DERIVATIVE_FORMATS.items():
+            output = io.BytesIO()
+            if pil_format == 'JPEG':
+                _flatten(current).save(output, pil_format, quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+            else:
+                current.save(output, pil_format, quality=DERIVATIVE_QUALITY, method=4)
+            renders.append({
+                'name': name,
+                'format': format,
+                'content_type': content_type,
+                'width': current.width,
+                'height': current.height,
+                'data': output.getvalue()
+            })
+    return renders
+
+
+# Pools are created on first use in each app process
+_process_pool = None
+_job_pool = None
+_pending = set()
+_lock = threading.Lock()
+
+def _get_pools():
+    global _process_pool, _job_pool
+    with _lock:
+        if _process_pool is None:
+            workers = int(os.getenv('DERIVATIVE_WORKERS', '2'))
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+            # One thread per render process fetches, uploads and records
+            _job_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives')
+    return _process_pool, _job_pool
+
+
+def derivatives_enabled():
+    return Image is not None and os.getenv('IMAGE_DERIVATIVES', '1') == '1'
+
+
+def generate_derivatives(content_hash, file_path):
+    """
+    Render, upload and record the derivatives of one stored image.
+
+    Content that already has every derivative is skipped. Products showing the
+    content are invalidated in the product cache once the rows are committed.
+    Returns True when derivatives were recorded.
+    """
+    existing = db.session.query(ImageDerivative.id).filter_by(content_hash=content_hash).count()
+    # Release the connection while the image is fetched, resized and uploaded
+    db.session.close()
+    if existing >= len(DERIVATIVE_SIZES) * len(DERIVATIVE_FORMATS):
+        return False
+
+    storage = get_storage()
+    process_pool, _ = _get_pools()
+    renders = process_pool.submit(render_derivatives, storage.read_file(file_path)).result()
+
+    file_names = [derivative_file_name(file_path, render['name'], render['format']) for render in renders]
+    upload_results = storage.upload_multiple_files(
+        [
+            FileStorage(stream=io.BytesIO(render['data']), filename=file_name, content_type=render['content_type'])
+            for render, file_name in zip(renders, file_names)
+        ],
+        folder=DERIVATIVE_FOLDER,
+        file_names=file_names
+    )
+    for error in upload_results['errors']:
+        print(f"Warning: {error}")
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            'content_hash': content_hash,
+            'name': render['name'],
+            'format': render['format'],
+            'file_path': result['file_name'],
+            'width': render['width'],
+            'height': render['height'],
+            'size': len(render['data']),
+            'created_at': now
+        }
+        for render, result in zip(renders, upload_results['results'])
+        if result is not None
+    ]
+    if not rows:
+        return False
+
+    # Lock the content row so a concurrent release either sees these rows and
+    # deletes them with the content, or has already removed the content; a
+    # row naming another object is a later upload with its own derivatives
+    content = db.session.query(StoredImage.id).filter_by(content_hash=content_hash, file_path=file_path)
+    if content.with_for_update().first() is None:
+        enqueue_storage_deletions([row['file_path'] for row in rows])
+        db.session.commit()
+        return False
+
+    stmt = insert(ImageDerivative).values(rows)
+    stmt = stmt.on_duplicate_key_update(
+        file_path=stmt.inserted.file_path,
+        width=stmt.inserted.width,
+        height=stmt.inserted.height,
+        size=stmt.inserted.size
+    )
+    db.session.execute(stmt)
+    product_ids = [
+        product_id for (product_id,) in
+        db.session.query(ProductImage.product_id).filter_by(content_hash=content_hash).distinct()
+    ]
+    db.session.commit()
+
+    cache = get_product_cache()
+    for product_id in product_ids:
+        cache.invalidate(product_id)
+    return True
+
+
+def _run_job(app, content_hash, file_path):
+    try:
+        with app.app_context():
+            generate_derivatives(content_hash, file_path)
+    except Exception:
+        print(f"Warning: Could not generate derivatives for {file_path}")
+        traceback.print_exc()
+    finally:
+        with _lock:
+            _pending.discard(content_hash)
+
+
+def schedule_derivatives(stored):
+    """
+    Generate derivatives for stored image entries in the background.
+
+    Call after the transaction linking the images has committed. Content
+    already being processed in this process is not scheduled twice.
+    """
+    if not stored or not derivatives_enabled():
+        return
+    jobs = {}
+    for entry in stored:
+        jobs.setdefault(entry['content_hash'], entry['file_name'])
+
+    app = current_app._get_current_object()
+    _, job_pool = _get_pools()
+    with _lock:
+        jobs = {content_hash: file_path for content_hash, file_path in jobs.items() if content_hash not in _pending}
+        _pending.update(jobs)
+    for content_hash, file_path in jobs.items():
+        job_pool.submit(_run_job, app, content_hash, file_path)
+
+
+def backfill_derivatives(batch_size=100):
+    """Generate missing derivatives for all stored content, returning how many were generated"""
+    generated = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.session.query(StoredImage.id, StoredImage.content_hash, StoredImage.file_path)
+            .filter(StoredImage.id > last_id)
+            .order_by(StoredImage.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return generated
+        last_id = batch[-1].id
+        for row in batch:
+            try:
+                if generate_derivatives(row.content_hash, row.file_path):
+                    generated += 1
+            except Exception as e:
+                db.session.rollback()
+                print(f"Warning: Could not generate derivatives for {row.file_path}: {str(e)}")
@@ -0,0 +1,231 @@
+import functools
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from flask import request, Response, g, has_app_context
+from flask_restful import abort
+from flask_restful.utils import unpack
+from sqlalchemy import update, delete, event
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models.idempotency_key import IdempotencyKey
+from utils.background import start_periodic_worker
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+class IdempotencyClaimLost(Exception):
+    """The request's key was taken over by a retry before the handler committed"""
+
+
+def idempotency_ttl():
+    """How long a key and its stored response are kept"""
+    return timedelta(hours=float(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24')))
+
+
+def idempotency_lease():
+    """How long a claimed key stays in progress before a retry may take it over"""
+    return timedelta(seconds=float(os.getenv('IDEMPOTENCY_KEY_LEASE', '60')))
+
+
+def _take_over(existing, request_hash, now):
+    """
+    Claim a key whose request is still marked in progress after its lease,
+    e.g. because the process running it died. Returns True when this request
+    took it over; the conditional UPDATE lets only one retry win. A key whose
+    handler committed anything is never taken over.
+    """
+    if existing.status_code is not None or existing.committed_at is not None:
+        return False
+    if existing.request_hash != request_hash:
+        return False
+    claimed_at = existing.claimed_at or existing.created_at
+    if claimed_at is None or claimed_at > now - idempotency_lease():
+        return False
+    if existing.claimed_at is None:
+        same_claim = IdempotencyKey.claimed_at.is_(None)
+    else:
+        same_claim = IdempotencyKey.claimed_at == existing.claimed_at
+    result = db.session.execute(
+        update(IdempotencyKey)
+        .where(
+            IdempotencyKey.id == existing.id,
+            IdempotencyKey.status_code.is_(None),
+            IdempotencyKey.committed_at.is_(None),
+            same_claim
+        )
+        .values(claimed_at=now),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _claim(scope, key, request_hash):
+    """
+    Record the key as in progress in its own committed transaction.
+    Returns (None, claimed_at) when this request claimed it, or the
+    existing record.
+    """
+    for _ in range(3):
+        # Whole seconds, so the claim compares equal once stored in DATETIME
+        now = datetime.utcnow().replace(microsecond=0)
+        db.session.add(IdempotencyKey(
+            scope=scope,
+            key=key,
+            request_hash=request_hash,
+            created_at=now,
+            claimed_at=now,
+            expires_at=now + idempotency_ttl()
+        ))
+        try:
+            db.session.commit()
+            return None, now
+        except IntegrityError:
+            db.session.rollback()
+        existing = IdempotencyKey.query.filter_by(scope=scope, key=key).first()
+        if existing is None:
+            continue  # Released in the meantime
+        if existing.expires_at > now:
+            if _take_over(existing, request_hash, now):
+                return None, now
+            return existing, None
+        db.session.delete(existing)
+        db.session.commit()
+    abort(409, message=f"{IDEMPOTENCY_HEADER} is in use, retry the request")
+
+
+def _owned(scope, key, claimed_at):
+    """Where clause for the key while this request still holds its claim"""
+    return (
+        IdempotencyKey.scope == scope,
+        IdempotencyKey.key == key,
+        IdempotencyKey.claimed_at == claimed_at,
+        IdempotencyKey.status_code.is_(None)
+    )
+
+
+@event.listens_for(db.session, 'before_commit')
+def _mark_committed(session):
+    """
+    Record, in the handler's own transaction, that it is committing writes
+    under the key. The key then stays claimed: a retry can no longer take
+    it over and run the handler again. A handler whose key was taken over
+    fails to commit instead.
+    """
+    claim = g.get('idempotency_claim') if has_app_context() else None
+    if claim is None or claim['committed']:
+        return
+    result = session.execute(
+        update(IdempotencyKey)
+        .where(*_owned(claim['scope'], claim['key'], claim['claimed_at']))
+        .values(committed_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount != 1:
+        raise IdempotencyClaimLost(f"{IDEMPOTENCY_HEADER} was taken over by a retry")
+    claim['committed'] = True
+
+
+def _release(scope, key, claimed_at):
+    """
+    Forget a claimed key so the request can be retried, unless the handler
+    committed writes; retries then get 409 until the key expires.
+    """
+    db.session.rollback()
+    db.session.execute(
+        delete(IdempotencyKey).where(*_owned(scope, key, claimed_at), IdempotencyKey.committed_at.is_(None))
+    )
+    db.session.commit()
+
+
+def _store(scope, key, claimed_at, data, status, headers):
+    # A request whose claim was taken over leaves the response to the new owner
+    db.session.execute(
+        update(IdempotencyKey)
+        .where(*_owned(scope, key, claimed_at))
+        .values(
+            status_code=status,
+            response_body=json.dumps(data, default=str),
+            response_headers=json.dumps(dict(headers or {}))
+        )
+    )
+    db.session.commit()
+
+
+def _replay(record, request_hash):
+    if record.request_hash != request_hash:
+        abort(422, message=f"{IDEMPOTENCY_HEADER} was already used for a different request")
+    if record.status_code is None:
+        abort(409, message=f"A request with this {IDEMPOTENCY_HEADER} is still being processed")
+    headers = json.loads(record.response_headers or '{}')
+    headers['Idempotent-Replayed'] = 'true'
+    return json.loads(record.response_body), record.status_code, headers
+
+
+def idempotent(handler):
+    """
+    Honour an Idempotency-Key header on a write handler.
+
+    The first request with a key runs the handler and stores its response;
+    retries with the same key and body get the stored response back without
+    running the handler again, while it is still running they get 409, and
+    with another body 422. A request still marked running after
+    idempotency_lease() without having committed anything is assumed lost,
+    and the next retry runs the handler. Errors and 5xx responses are not
+    stored, so the request can be retried if the handler committed nothing.
+    Requests without the header run as usual.
+    Place it above marshal_with so the marshalled response is stored.
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(*args, **kwargs)
+        if len(key) > 255:
+            abort(400, message=f"{IDEMPOTENCY_HEADER} must be at most 255 characters")
+        scope = f"{request.method} {request.path}"[:255]
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+
+        existing, claimed_at = _claim(scope, key, request_hash)
+        if existing is not None:
+            return _replay(existing, request_hash)
+        g.idempotency_claim = {'scope': scope, 'key': key, 'claimed_at': claimed_at, 'committed': False}
+        try:
+            result = handler(*args, **kwargs)
+        except Exception:
+            g.idempotency_claim = None
+            _release(scope, key, claimed_at)
+            raise
+        g.idempotency_claim = None
+        if isinstance(result, Response):
+            _release(scope, key, claimed_at)
+            return result
+        data, status, headers = unpack(result)
+        if status >= 500:
+            _release(scope, key, claimed_at)
+        else:
+            _store(scope, key, claimed_at, data, status, headers)
+        return result
+    return wrapper
+
+
+def purge_idempotency_keys(batch_size=1000):
+    """Delete one batch of expired keys, returning how many were deleted"""
+    ids = [
+        key_id for (key_id,) in
+        db.session.query(IdempotencyKey.id)
+        .filter(IdempotencyKey.expires_at <= datetime.utcnow())
+        .order_by(IdempotencyKey.expires_at)
+        .limit(batch_size)
+    ]
+    if ids:
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+
+def start_idempotency_key_purger(app, interval=600):
+    """Delete expired idempotency keys on a background thread of this process"""
+    return start_periodic_worker(app, 'idempotency-keys', purge_idempotency_keys, interval)
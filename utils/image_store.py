@@ -0,0 +1,234 @@
+import os
+import secrets
+import mimetypes
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import update, delete, func
+from sqlalchemy.dialects.mysql import insert
+from werkzeug.utils import secure_filename
+from extensions import db
+from models.stored_image import StoredImage
+from models.image_derivative import ImageDerivative
+from utils.storage import get_storage, measure_stream
+from utils.image_urls import build_image_url
+from utils.storage_deletions import enqueue_storage_deletions
+
+
+def content_file_name(content_hash, original_filename):
+    """
+    Storage name for one upload of content: its SHA-256, a random suffix and
+    the original extension. A name is never written twice, so deleting a
+    released object cannot remove a later upload of the same content.
+    """
+    ext = os.path.splitext(secure_filename(original_filename))[1].lower()
+    return f"{content_hash}_{secrets.token_hex(8)}{ext}"
+
+
+def store_images(files, folder="products"):
+    """
+    Store uploaded image files by content.
+
+    `files` is a list of (index, FileStorage). Each file is hashed in a chunked
+    pass; content that is already stored is linked instead of uploaded again,
+    and content repeated within the request is uploaded once. New content is
+    uploaded concurrently.
+
+    Returns (stored, errors): one entry per stored file in input order with
+    'index', 'file_name', 'file_url', 'content_hash', 'size', 'content_type',
+    'upload' (the object this request uploaded for it, None when existing
+    content was reused) and the 'file'. link_images() settles 'file_name'.
+    """
+    hashed = []
+    for index, file in files:
+        size, _, content_hash = measure_stream(file.stream)
+        content_type = file.content_type or mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+        hashed.append((index, file, content_hash, size, content_type))
+
+    existing = dict(
+        db.session.query(StoredImage.content_hash, StoredImage.file_path)
+        .filter(StoredImage.content_hash.in_({entry[2] for entry in hashed}))
+        .all()
+    ) if hashed else {}
+
+    # Release the connection while files are uploading
+    db.session.close()
+
+    to_upload = {}
+    for index, file, content_hash, size, content_type in hashed:
+        if content_hash not in existing and content_hash not in to_upload:
+            to_upload[content_hash] = file
+
+    uploaded = {}
+    errors = []
+    if to_upload:
+        storage = get_storage()
+        content_hashes = list(to_upload)
+        upload_results = storage.upload_multiple_files(
+            [to_upload[content_hash] for content_hash in content_hashes],
+            folder=folder,
+            file_names=[content_file_name(content_hash, to_upload[content_hash].filename) for content_hash in content_hashes]
+        )
+        errors = upload_results['errors']
+        for content_hash, result in zip(content_hashes, upload_results['results']):
+            if result is not None:
+                uploaded[content_hash] = result['file_name']
+
+    stored = []
+    for index, file, content_hash, size, content_type in hashed:
+        if content_hash in existing:
+            file_name = existing[content_hash]
+        elif content_hash in uploaded:
+            file_name = uploaded[content_hash]
+        else:
+            continue  # Upload failed, reported in errors
+        stored.append({
+            'index': index,
+            'file_name': file_name,
+            'file_url': build_image_url(file_name),
+            'content_hash': content_hash,
+            'size': size,
+            'content_type': content_type,
+            'upload': None if content_hash in existing else file_name,
+            'file': file
+        })
+    return stored, errors
+
+
+def link_images(stored):
+    """
+    Add one reference per stored entry to Stored_Images, in the caller's
+    transaction. A single multi-row upsert creates rows for new content and
+    bumps ref_count for content that is already known.
+
+    Reused content is locked and checked again first: it may have been
+    released while the request was uploading. Such content is uploaded again
+    under a new name. After the upsert every entry is pointed at the object
+    its content row names; uploads that lost to a concurrent request for the
+    same content are queued for deletion. Call it before the entries'
+    file_name is written anywhere.
+    """
+    if not stored:
+        return
+    reused = {entry['content_hash']: entry for entry in stored if entry['upload'] is None}
+    if reused:
+        present = {
+            content_hash for (content_hash,) in
+            db.session.query(StoredImage.content_hash)
+            .filter(StoredImage.content_hash.in_(sorted(reused)))
+            .order_by(StoredImage.content_hash)
+            .with_for_update()
+        }
+        storage = get_storage()
+        for content_hash in sorted(set(reused) - present):
+            file = reused[content_hash]['file']
+            folder = os.path.dirname(reused[content_hash]['file_name'])
+            file.stream.seek(0)
+            result = storage.upload_file(file, folder=folder, file_name=content_file_name(content_hash, file.filename))
+            for entry in stored:
+                if entry['content_hash'] == content_hash:
+                    entry['file_name'] = entry['upload'] = result['file_name']
+
+    counts = Counter(entry['content_hash'] for entry in stored)
+    first = {}
+    for entry in stored:
+        first.setdefault(entry['content_hash'], entry)
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            'content_hash': content_hash,
+            'file_path': first[content_hash]['file_name'],
+            'content_type': first[content_hash]['content_type'],
+            'size': first[content_hash]['size'],
+            'ref_count': counts[content_hash],
+            'created_at': now
+        }
+        # Sorted so concurrent requests lock rows in the same order
+        for content_hash in sorted(counts)
+    ]
+    stmt = insert(StoredImage).values(rows)
+    stmt = stmt.on_duplicate_key_update(ref_count=StoredImage.ref_count + stmt.inserted.ref_count)
+    db.session.execute(stmt)
+
+    # The rows are locked by the upsert; read the object each one names
+    file_paths = dict(
+        db.session.query(StoredImage.content_hash, StoredImage.file_path)
+        .filter(StoredImage.content_hash.in_(sorted(counts)))
+        .with_for_update()
+        .all()
+    )
+    redundant = set()
+    for entry in stored:
+        file_path = file_paths[entry['content_hash']]
+        if entry['upload'] is not None and entry['upload'] != file_path:
+            redundant.add(entry['upload'])
+        entry['file_name'] = file_path
+        entry['file_url'] = build_image_url(file_path)
+    enqueue_storage_deletions(redundant)
+
+
+def release_images(content_hashes):
+    """
+    Drop one reference per hash, in the caller's transaction.
+
+    Content that is no longer referenced loses its row and its derivative
+    rows. Returns the storage paths of the original and derivative objects,
+    which the caller queues for deletion in the same transaction.
+    """
+    counts = Counter(content_hash for content_hash in content_hashes if content_hash)
+    if not counts:
+        return []
+
+    for content_hash in sorted(counts):
+        db.session.execute(
+            update(StoredImage)
+            .where(StoredImage.content_hash == content_hash)
+            .values(ref_count=func.greatest(StoredImage.ref_count - counts[content_hash], 0))
+        )
+
+    orphaned = db.session.query(StoredImage.content_hash, StoredImage.file_path).filter(
+        StoredImage.content_hash.in_(list(counts)),
+        StoredImage.ref_count == 0
+    ).all()
+    if not orphaned:
+        return []
+
+    orphaned_hashes = [row.content_hash for row in orphaned]
+    # Conditional delete: a concurrent upload may have re-referenced the content
+    db.session.execute(
+        delete(StoredImage).where(
+            StoredImage.content_hash.in_(orphaned_hashes),
+            StoredImage.ref_count == 0
+        )
+    )
+    derivative_paths = [
+        file_path for (file_path,) in
+        db.session.query(ImageDerivative.file_path).filter(ImageDerivative.content_hash.in_(orphaned_hashes))
+    ]
+    if derivative_paths:
+        db.session.execute(delete(ImageDerivative).where(ImageDerivative.content_hash.in_(orphaned_hashes)))
+    return [row.file_path for row in orphaned] + derivative_paths
+
+
+def release_image_rows(images):
+    """
+    Drop the references held by ProductImage rows that are being deleted, in
+    the caller's transaction. Returns the storage paths to queue for
+    deletion: unreferenced content and its derivatives, plus the objects of
+    legacy rows without a content hash, which own their object.
+    """
+    unreferenced = release_images([image.content_hash for image in images])
+    unreferenced.extend(image.image_path for image in images if not image.content_hash)
+    return unreferenced
+
+
+def discard_images(stored):
+    """
+    Queue the objects uploaded for a request whose database write failed
+    for deletion. Upload names are unique, so no other request uses them.
+    """
+    uploads = {entry['upload'] for entry in stored if entry['upload'] is not None}
+    if not uploads:
+        return
+    enqueue_storage_deletions(uploads)
+    db.session.commit()
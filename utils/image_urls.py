@@ -0,0 +1,29 @@
+import os
+
+# Precomputed "<base url>/" prefix, built on first use
+_url_prefix = None
+
+def get_image_url_prefix():
+    """
+    Public URL prefix for stored images.
+
+    IMAGE_BASE_URL points at a CDN or the bucket's public download URL; it
+    defaults to the Backblaze friendly URL of B2_BUCKET_NAME, or to /media
+    for the local and in-memory backends. No storage SDK call is involved,
+    so reads never depend on storage availability.
+    """
+    global _url_prefix
+    if _url_prefix is None:
+        base_url = os.getenv('IMAGE_BASE_URL')
+        if not base_url and os.getenv('STORAGE_BACKEND', 'b2').lower() in ('local', 'memory'):
+            base_url = '/media'
+        elif not base_url:
+            base_url = f"https://f002.backblazeb2.com/file/{os.getenv('B2_BUCKET_NAME', '')}"
+        _url_prefix = base_url.rstrip('/') + '/'
+    return _url_prefix
+
+def build_image_url(file_path):
+    """Get public URL for a stored file path"""
+    if not file_path:
+        return None
+    return get_image_url_prefix() + file_path
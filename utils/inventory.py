@@ -0,0 +1,275 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete, insert, case, func
+from extensions import db
+from models.product_variant import ProductVariant
+from models.inventory_hold import InventoryHold
+from models.order import Order
+from models.order_item import OrderItem
+from utils.cache import LRUCache
+from utils.background import start_periodic_worker
+from utils.coupon_ops import release_order_coupons
+from utils.order_events import record_status_changes
+
+_stock = func.coalesce(ProductVariant.stock_quantity, 0)
+_reserved = func.coalesce(ProductVariant.reserved_quantity, 0)
+
+
+def hold_minutes():
+    """Minutes stock stays held for an unpaid order"""
+    return int(os.getenv('INVENTORY_HOLD_MINUTES', '15'))
+
+
+def hold_stock(order_id, quantities, now=None):
+    """
+    Reserve {product_variant_id: quantity} for an order, in the caller's
+    transaction, until hold_minutes() from now.
+
+    One UPDATE raises reserved_quantity on every variant that has enough
+    available stock, and one multi-row INSERT records the holds. Returns the
+    expiry time, or None when some variant is short; the caller must then
+    roll back.
+    """
+    if not quantities:
+        return None
+    now = now or datetime.utcnow()
+    ids = sorted(quantities)
+    requested = case(quantities, value=ProductVariant.id)
+    result = db.session.execute(
+        update(ProductVariant)
+        .where(ProductVariant.id.in_(ids), _stock - _reserved >= requested)
+        .values(reserved_quantity=_reserved + requested),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount != len(ids):
+        return None
+    expires_at = now + timedelta(minutes=hold_minutes())
+    db.session.execute(insert(InventoryHold).values([
+        {
+            'order_id': order_id,
+            'product_variant_id': variant_id,
+            'quantity': quantities[variant_id],
+            'expires_at': expires_at,
+            'created_at': now
+        }
+        for variant_id in ids
+    ]))
+    return expires_at
+
+
+def short_stock(quantities):
+    """Variant ids of {product_variant_id: quantity} without enough available stock, or deleted"""
+    if not quantities:
+        return []
+    available = dict(
+        db.session.query(ProductVariant.id, _stock - _reserved)
+        .filter(ProductVariant.id.in_(list(quantities))).all()
+    )
+    return sorted(
+        variant_id for variant_id, quantity in quantities.items()
+        if (available.get(variant_id) or 0) < quantity
+    )
+
+
+def _end_holds(holds, take):
+    """
+    Remove (id, product_variant_id, quantity) holds with one UPDATE and one
+    DELETE, lowering reserved_quantity and, when `take` is set,
+    stock_quantity by the held amounts.
+    """
+    if not holds:
+        return 0
+    quantities = {}
+    for _, variant_id, quantity in holds:
+        quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+    held = case(quantities, value=ProductVariant.id)
+    values = {'reserved_quantity': case((_reserved > held, _reserved - held), else_=0)}
+    if take:
+        values['stock_quantity'] = _stock - held
+    db.session.execute(
+        update(ProductVariant).where(ProductVariant.id.in_(sorted(quantities))).values(**values),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.execute(
+        delete(InventoryHold).where(InventoryHold.id.in_([hold_id for hold_id, _, _ in holds])),
+        execution_options={'synchronize_session': False}
+    )
+    return len(holds)
+
+
+def _lock_holds(order_ids):
+    return (
+        db.session.query(InventoryHold.id, InventoryHold.product_variant_id, InventoryHold.quantity)
+        .filter(InventoryHold.order_id.in_(list(order_ids)))
+        .order_by(InventoryHold.id)
+        .with_for_update()
+        .all()
+    )
+
+
+def lock_order_holds(order_ids):
+    """
+    Lock the holds of orders and the variant rows they hold, in the caller's
+    transaction. Stock paths lock holds, then variants, then orders; callers
+    that lock order rows before releasing holds call this first.
+    """
+    if not order_ids:
+        return []
+    holds = _lock_holds(order_ids)
+    if holds:
+        (
+            db.session.query(ProductVariant.id)
+            .filter(ProductVariant.id.in_(sorted({variant_id for _, variant_id, _ in holds})))
+            .order_by(ProductVariant.id)
+            .with_for_update()
+            .all()
+        )
+    return holds
+
+
+def take_order_stock(order_id):
+    """
+    Take an order's stock once it is paid, in the caller's transaction.
+
+    Its holds become sold stock. An order whose holds expired after it moved
+    past pending has none left; its quantities are then taken from available
+    stock with one conditional UPDATE. Returns the ids of the products whose
+    stock changed, or None when some variant is short; the caller must then
+    roll back.
+    """
+    items = (
+        db.session.query(OrderItem.product_id, OrderItem.product_variant_id, OrderItem.quantity)
+        .filter(OrderItem.order_id == order_id).all()
+    )
+    holds = _lock_holds([order_id])
+    if holds:
+        _end_holds(holds, take=True)
+    elif items:
+        quantities = {}
+        for _, variant_id, quantity in items:
+            quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+        taken = case(quantities, value=ProductVariant.id)
+        result = db.session.execute(
+            update(ProductVariant)
+            .where(ProductVariant.id.in_(sorted(quantities)), _stock - _reserved >= taken)
+            .values(stock_quantity=_stock - taken),
+            execution_options={'synchronize_session': False}
+        )
+        if result.rowcount != len(quantities):
+            return None
+    return sorted({product_id for product_id, _, _ in items})
+
+
+def release_order_holds(order_ids):
+    """Give the held stock of cancelled orders back, in the caller's transaction"""
+    if not order_ids:
+        return 0
+    return _end_holds(_lock_holds(order_ids), take=False)
+
+
+def expire_hold_batch(batch_size=None, now=None):
+    """
+    Release one batch of expired holds and cancel their unpaid orders.
+
+    Holds are taken oldest first with SKIP LOCKED, so holds being converted
+    by a payment right now are left alone. Only holds of pending, unpaid
+    orders expire; an order moved past pending keeps its stock until it is
+    paid or cancelled. The coupon uses of cancelled orders are released too,
+    and each cancellation is logged. Returns the number of holds released.
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv('INVENTORY_HOLD_BATCH', '500'))
+    now = now or datetime.utcnow()
+    # The subquery is a plain read, so the order rows are not locked here
+    pending = db.session.query(Order.id).filter(Order.order_status == 'pending', Order.payment_status != 'paid')
+    holds = (
+        db.session.query(InventoryHold.id, InventoryHold.product_variant_id, InventoryHold.quantity, InventoryHold.order_id)
+        .filter(InventoryHold.expires_at <= now, InventoryHold.order_id.in_(pending))
+        .order_by(InventoryHold.expires_at, InventoryHold.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not holds:
+        db.session.commit()
+        return 0
+
+    _end_holds([(hold_id, variant_id, quantity) for hold_id, variant_id, quantity, _ in holds], take=False)
+    order_ids = sorted({order_id for _, _, _, order_id in holds})
+    unpaid = [
+        order_id for (order_id,) in
+        db.session.query(Order.id)
+        .filter(Order.id.in_(order_ids), Order.order_status == 'pending', Order.payment_status != 'paid')
+        .with_for_update()
+    ]
+    if unpaid:
+        db.session.execute(
+            update(Order).where(Order.id.in_(unpaid)).values(order_status='cancelled'),
+            execution_options={'synchronize_session': False}
+        )
+        release_order_coupons(unpaid)
+        record_status_changes([(order_id, 'pending', 'cancelled') for order_id in unpaid], 'hold_expired', now)
+    db.session.commit()
+    return len(holds)
+
+
+def expire_holds(batch_size=None):
+    """Release every expired hold batch by batch, returning how many were released"""
+    total = 0
+    while True:
+        released = expire_hold_batch(batch_size)
+        if not released:
+            return total
+        total += released
+
+
+def start_hold_expiry_worker(app, interval=None):
+    """Release expired holds on a background thread of this process"""
+    if interval is None:
+        interval = float(os.getenv('INVENTORY_HOLD_INTERVAL', '30'))
+    return start_periodic_worker(app, 'inventory-holds', expire_hold_batch, interval)
+
+
+class AvailabilityCache:
+    """
+    Available stock (stock_quantity - reserved_quantity) by variant id, kept
+    for `ttl` seconds so product pages read it without touching the rows
+    checkouts lock. Missing ids are loaded with one query.
+    """
+
+    def __init__(self, maxsize=20000, ttl=5):
+        self.ttl = ttl
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get_many(self, variant_ids):
+        """{variant_id: available units} for the variants that exist"""
+        found = {}
+        missing = []
+        for variant_id in variant_ids:
+            available = self.entries.get(variant_id) if self.ttl > 0 else None
+            if available is None:
+                missing.append(variant_id)
+            else:
+                found[variant_id] = available
+        if missing:
+            rows = (
+                db.session.query(ProductVariant.id, _stock - _reserved)
+                .filter(ProductVariant.id.in_(missing)).all()
+            )
+            for variant_id, available in rows:
+                available = max(int(available or 0), 0)
+                if self.ttl > 0:
+                    self.entries.set(variant_id, available)
+                found[variant_id] = available
+        return found
+
+
+# Initialize global instance
+availability_cache = None
+
+def get_availability_cache():
+    """Get or create the process-wide availability cache"""
+    global availability_cache
+    if availability_cache is None:
+        availability_cache = AvailabilityCache(ttl=int(os.getenv('AVAILABILITY_CACHE_TTL', '5')))
+    return availability_cache
@@ -0,0 +1,24 @@
+from datetime import datetime
+from sqlalchemy import insert
+from extensions import db
+from models.order_event import OrderEvent
+
+
+def record_status_changes(changes, source, now=None):
+    """
+    Append one status event per (order_id, from_status, to_status) with a
+    single multi-row INSERT, in the caller's transaction.
+    """
+    if not changes:
+        return
+    now = now or datetime.utcnow()
+    db.session.execute(insert(OrderEvent).values([
+        {
+            'order_id': order_id,
+            'from_status': from_status,
+            'to_status': to_status,
+            'source': source,
+            'created_at': now
+        }
+        for order_id, from_status, to_status in changes
+    ]))
@@ -0,0 +1,66 @@
+from datetime import datetime
+from sqlalchemy import update
+from extensions import db
+from models.order import Order
+from utils.order_events import record_status_changes
+from utils.inventory import lock_order_holds, release_order_holds
+from utils.coupon_ops import release_order_coupons
+
+# order_status -> statuses an order may move to from it
+ORDER_TRANSITIONS = {
+    'pending': ('confirmed', 'cancelled'),
+    'confirmed': ('out_for_Delivery', 'cancelled'),
+    'out_for_Delivery': ('delivered', 'cancelled'),
+    'delivered': (),
+    'cancelled': (),
+}
+MAX_ORDER_TRANSITIONS = 5000
+
+
+def transition_orders(targets, source='bulk', now=None):
+    """
+    Move orders to new statuses, in the caller's transaction.
+
+    `targets` maps order_id to the wanted order_status. The orders are
+    locked, each move is checked against ORDER_TRANSITIONS, and the allowed
+    ones are applied with one UPDATE per target status and logged with one
+    event INSERT. Cancelled orders give their held stock and coupon uses
+    back. Returns ({status: [order_ids]} applied, [order_ids] already in
+    the wanted status, [rejection dicts]).
+    """
+    now = now or datetime.utcnow()
+    # Holds and their variants are locked before the order rows, as the
+    # hold expiry pass and payments do
+    lock_order_holds(sorted(order_id for order_id, status in targets.items() if status == 'cancelled'))
+    current = dict(
+        db.session.query(Order.id, Order.order_status)
+        .filter(Order.id.in_(sorted(targets)))
+        .order_by(Order.id)
+        .with_for_update()
+        .all()
+    )
+
+    applied, unchanged, rejected, changes = {}, [], [], []
+    for order_id in sorted(targets):
+        status = targets[order_id]
+        if order_id not in current:
+            rejected.append({'order_id': order_id, 'reason': 'not_found'})
+        elif current[order_id] == status:
+            unchanged.append(order_id)
+        elif status not in ORDER_TRANSITIONS.get(current[order_id], ()):
+            rejected.append({'order_id': order_id, 'reason': 'invalid_transition', 'order_status': current[order_id]})
+        else:
+            applied.setdefault(status, []).append(order_id)
+            changes.append((order_id, current[order_id], status))
+
+    for status, order_ids in applied.items():
+        db.session.execute(
+            update(Order).where(Order.id.in_(order_ids)).values(order_status=status),
+            execution_options={'synchronize_session': False}
+        )
+    record_status_changes(changes, source, now)
+    cancelled = applied.get('cancelled', [])
+    if cancelled:
+        release_order_holds(cancelled)
+        release_order_coupons(cancelled)
+    return applied, unchanged, rejected
@@ -0,0 +1,173 @@
+from decimal import Decimal, ROUND_HALF_UP
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from models.cart import Cart
+from models.cart_item import CartItem
+from models.coupon import Coupon, coupon_code_key
+from models.product_variant import ProductVariant
+from utils.promotion_index import get_promotion_index
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+# discount_type values read as a percentage; any other type is a fixed amount
+PERCENT_TYPES = ('percentage', 'percent', '%')
+
+
+def to_decimal(value):
+    """Exact Decimal for a column or request value; floats go through str"""
+    if value is None:
+        return ZERO
+    if isinstance(value, float):
+        return Decimal(str(value))
+    return Decimal(value)
+
+
+def money(value):
+    """Round to cents, half up"""
+    return to_decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def is_percentage(discount_type):
+    return (discount_type or '').strip().lower() in PERCENT_TYPES
+
+
+def discount_amount(discount_type, value, base, quantity=1):
+    """
+    Discount on `base`: a percentage of it, or a fixed amount per unit for
+    `quantity` units. Never negative and never more than `base`.
+    """
+    if is_percentage(discount_type):
+        amount = base * to_decimal(value) / 100
+    else:
+        amount = to_decimal(value) * quantity
+    return money(min(max(amount, ZERO), base))
+
+
+def is_live(start_date, end_date, now):
+    return (start_date is None or start_date <= now) and (end_date is None or now <= end_date)
+
+
+def promotions_for_products(products, now):
+    """Live promotions for (product_id, category_id) pairs, keyed by product_id"""
+    return get_promotion_index().for_products(products, now)
+
+
+def best_promotion(promotions, line_subtotal, quantity, order_value):
+    """The promotion giving the largest discount on a line, and that discount"""
+    best, best_discount = None, ZERO
+    for promotion in sorted(promotions, key=lambda p: p.id):
+        if to_decimal(promotion.min_order_value) > order_value:
+            continue
+        discount = discount_amount(promotion.discount_type, promotion.discount_value, line_subtotal, quantity)
+        if discount > best_discount:
+            best, best_discount = promotion, discount
+    return best, best_discount
+
+
+def coupon_is_valid(coupon, order_value, now):
+    return (
+        coupon is not None
+        and coupon.is_active == 1
+        and is_live(coupon.start_date, coupon.end_date, now)
+        and to_decimal(coupon.min_order_value) <= order_value
+        and (coupon.usage_limit is None or (coupon.used_count or 0) < coupon.usage_limit)
+    )
+
+
+class CartPricing:
+    """
+    Result of pricing a cart: its items in id order, whether any stored value
+    changed, and the variants by id. Holding the variants keeps them in the
+    session's identity map, so item.product_variant resolves without a query.
+    """
+
+    def __init__(self, cart, items, variants, coupon, changed):
+        self.cart = cart
+        self.items = items
+        self.variants = variants
+        self.coupon = coupon
+        self.changed = changed
+
+
+def _assign(obj, name, value, changes):
+    current = getattr(obj, name)
+    if current is None or value is None:
+        differs = current is not value
+    else:
+        differs = to_decimal(current) != to_decimal(value)
+    if differs:
+        setattr(obj, name, value)
+        changes.append(name)
+
+
+def price_cart(cart, now=None):
+    """
+    Recompute every line and the totals of a cart from current prices.
+
+    Loads the items, their variants with products and the coupon in a
+    constant number of queries, whatever the number of items; promotions
+    come from the in-process promotion index.
+    Each line gets its best promotion; the coupon applies to the discounted
+    total. Values are set on the ORM objects in the caller's transaction.
+    """
+    now = now or datetime.utcnow()
+    changes = []
+
+    items = CartItem.query.filter_by(cart_id=cart.id).order_by(CartItem.id).all()
+    variant_ids = {item.product_variant_id for item in items}
+    variants = {
+        variant.id: variant
+        for variant in ProductVariant.query.options(joinedload(ProductVariant.product))
+        .filter(ProductVariant.id.in_(variant_ids)).all()
+    } if variant_ids else {}
+    promotions = promotions_for_products(
+        {(variant.product_id, variant.product.category_id) for variant in variants.values()},
+        now
+    )
+
+    lines = []
+    for item in items:
+        variant = variants.get(item.product_variant_id)
+        # A line whose variant is gone keeps the price it was added at
+        unit_price = money(variant.variant_price if variant else item.product_actual_price)
+        quantity = max(item.quantity or 0, 0)
+        lines.append((item, variant, unit_price, quantity, unit_price * quantity))
+    actual_amount = sum((line[4] for line in lines), ZERO)
+
+    items_total = ZERO
+    for item, variant, unit_price, quantity, line_subtotal in lines:
+        candidates = promotions.get(variant.product_id, []) if variant else []
+        promotion, promotion_discount = best_promotion(candidates, line_subtotal, quantity, actual_amount)
+        line_total = line_subtotal - promotion_discount
+        items_total += line_total
+        _assign(item, 'product_actual_price', unit_price, changes)
+        _assign(item, 'applicable_promotion_id', promotion.id if promotion else None, changes)
+        _assign(item, 'promotion_discount', promotion_discount, changes)
+        _assign(item, 'After_discounted_total', line_total, changes)
+
+    coupon = None
+    coupon_discount = ZERO
+    if cart.coupon_active and (cart.coupon_id or cart.coupon_code):
+        if cart.coupon_id:
+            coupon = Coupon.query.get(cart.coupon_id)
+        else:
+            coupon = Coupon.query.filter_by(code_key=coupon_code_key(cart.coupon_code)).first()
+        if coupon_is_valid(coupon, items_total, now):
+            coupon_discount = discount_amount(coupon.discount_type, coupon.discount_values, items_total)
+            _assign(cart, 'coupon_id', coupon.id, changes)
+            if cart.coupon_code != coupon.code:
+                cart.coupon_code = coupon.code
+                changes.append('coupon_code')
+
+    _assign(cart, 'actual_amount', actual_amount, changes)
+    _assign(cart, 'coupon_discount', coupon_discount, changes)
+    _assign(cart, 'dicounted_total_price', items_total - coupon_discount, changes)
+    return CartPricing(cart, items, variants, coupon, bool(changes))
+
+
+def reprice_cart(cart_id, now=None):
+    """Price the cart with cart_id, returning its CartPricing or None if it does not exist"""
+    cart = Cart.query.get(cart_id)
+    if cart is None:
+        return None
+    return price_cart(cart, now)
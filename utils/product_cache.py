@@ -0,0 +1,104 @@
+import os
+import json
+from utils.cache import LRUCache, LocalSharedBackend
+
+
+class ProductDocumentCache:
+    """
+    Precomputed product documents (product + category + images + variants),
+    keyed by product id.
+
+    Reads go to the in-process LRU first, then to the optional shared backend,
+    and only missing documents are built through the loader. Writers call
+    refresh() or invalidate() for the product they touched.
+    """
+
+    def __init__(self, maxsize=5000, backend=None, local_ttl=None):
+        self.local = LRUCache(maxsize=maxsize, ttl=local_ttl)
+        self.backend = backend
+
+    @staticmethod
+    def _key(product_id):
+        return f"product:{product_id}"
+
+    def _store(self, product_id, document):
+        self.local.set(product_id, document)
+        if self.backend is not None:
+            self.backend.set(self._key(product_id), json.dumps(document, separators=(',', ':')))
+
+    def get_many(self, product_ids, loader):
+        """
+        Return documents for product_ids in the given order.
+        `loader(ids)` must return {product_id: document} for the ids it can build;
+        ids it does not return (deleted products) are skipped.
+        """
+        documents = {}
+        missing = []
+        for product_id in product_ids:
+            document = self.local.get(product_id)
+            if document is None:
+                missing.append(product_id)
+            else:
+                documents[product_id] = document
+
+        if missing and self.backend is not None:
+            found = self.backend.get_many([self._key(product_id) for product_id in missing])
+            still_missing = []
+            for product_id in missing:
+                raw = found.get(self._key(product_id))
+                if raw is None:
+                    still_missing.append(product_id)
+                    continue
+                document = json.loads(raw)
+                self.local.set(product_id, document)
+                documents[product_id] = document
+            missing = still_missing
+
+        if missing:
+            for product_id, document in loader(missing).items():
+                self._store(product_id, document)
+                documents[product_id] = document
+
+        return [documents[product_id] for product_id in product_ids if product_id in documents]
+
+    def get(self, product_id, loader):
+        """Return the document for one product, or None if it does not exist"""
+        documents = self.get_many([product_id], loader)
+        return documents[0] if documents else None
+
+    def refresh(self, product_id, loader):
+        """Rebuild the document for one product after it was written"""
+        document = loader([product_id]).get(product_id)
+        if document is None:
+            self.invalidate(product_id)
+        else:
+            self._store(product_id, document)
+        return document
+
+    def invalidate(self, product_id):
+        self.local.delete(product_id)
+        if self.backend is not None:
+            self.backend.delete(self._key(product_id))
+
+    def clear(self):
+        self.local.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+
+# Initialize global instance
+product_cache = None
+
+def get_product_cache():
+    """Get or create the ProductDocumentCache instance"""
+    global product_cache
+    if product_cache is None:
+        maxsize = int(os.getenv('PRODUCT_CACHE_SIZE', '5000'))
+        backend = None
+        if os.getenv('PRODUCT_CACHE_BACKEND', 'none').lower() == 'local':
+            backend = LocalSharedBackend()
+        # Writes invalidate only this worker's copy (and the shared one), so
+        # copies held by other workers must age out on their own
+        local_ttl = int(os.getenv('PRODUCT_CACHE_LOCAL_TTL', '30')) or None
+        product_cache = ProductDocumentCache(maxsize=maxsize, backend=backend, local_ttl=local_ttl)
+    return product_cache
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from datetime import datetime
+from extensions import db
+from models.promotion import Promotion
+from models.promotion_product import PromotionProduct
+from models.promotion_category import PromotionCategory
+
+
+class PromotionEntry:
+    """Snapshot of the Promotion columns pricing needs, safe to share across requests"""
+
+    __slots__ = ('id', 'discount_type', 'discount_value', 'min_order_value', 'start_date', 'end_date')
+
+    def __init__(self, promotion):
+        self.id = promotion.id
+        self.discount_type = promotion.discount_type
+        self.discount_value = promotion.discount_value
+        self.min_order_value = promotion.min_order_value or 0
+        self.start_date = promotion.start_date
+        self.end_date = promotion.end_date
+
+    def is_live(self, now):
+        return self.start_date <= now <= self.end_date
+
+
+class PromotionIndex:
+    """
+    Process-local index of active promotions by product_id and category_id.
+
+    Only active promotions that have not ended are indexed; each entry keeps
+    its start and end dates so lookups filter on the time window without a
+    query. Promotion writes in this process refresh their entry; a full
+    rebuild every `ttl` seconds picks up changes made by other processes and
+    to the promotion link tables.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._by_product = {}
+        self._by_category = {}
+        self._links = {}  # promotion_id -> (product_ids, category_ids)
+        self._built_at = None
+        self._lock = threading.Lock()
+        # Held by the one thread rebuilding a stale index
+        self._build_lock = threading.Lock()
+
+    def _load(self, promotion_ids=None):
+        """Load active, unexpired promotions and their links; all of them when promotion_ids is None"""
+        query = Promotion.query.filter(Promotion.active == 1, Promotion.end_date >= datetime.utcnow())
+        if promotion_ids is not None:
+            query = query.filter(Promotion.id.in_(promotion_ids))
+        entries = {promotion.id: PromotionEntry(promotion) for promotion in query.all()}
+
+        links = {promotion_id: (set(), set()) for promotion_id in entries}
+        if entries:
+            product_rows = db.session.query(PromotionProduct.promotion_id, PromotionProduct.product_id).filter(
+                PromotionProduct.promotion_id.in_(list(entries))
+            )
+            for promotion_id, product_id in product_rows:
+                links[promotion_id][0].add(product_id)
+            category_rows = db.session.query(PromotionCategory.promotion_id, PromotionCategory.category_id).filter(
+                PromotionCategory.promotion_id.in_(list(entries))
+            )
+            for promotion_id, category_id in category_rows:
+                links[promotion_id][1].add(category_id)
+        return entries, links
+
+    @staticmethod
+    def _add(index, key, entry):
+        index[key] = tuple(sorted(index.get(key, ()) + (entry,), key=lambda e: e.id))
+
+    @staticmethod
+    def _discard(index, key, promotion_id):
+        remaining = tuple(entry for entry in index.get(key, ()) if entry.id != promotion_id)
+        if remaining:
+            index[key] = remaining
+        else:
+            index.pop(key, None)
+
+    def build(self):
+        """Rebuild the whole index with three queries"""
+        entries, links = self._load()
+        by_product, by_category = {}, {}
+        for promotion_id, (product_ids, category_ids) in links.items():
+            for product_id in product_ids:
+                self._add(by_product, product_id, entries[promotion_id])
+            for category_id in category_ids:
+                self._add(by_category, category_id, entries[promotion_id])
+        with self._lock:
+            # Readers keep using the old dicts until the swap
+            self._by_product, self._by_category, self._links = by_product, by_category, links
+            self._built_at = time.monotonic()
+
+    def refresh(self, promotion_id):
+        """Reload one promotion after it was created, changed or deleted"""
+        if self._built_at is None:
+            return  # Built on first lookup
+        entries, links = self._load([promotion_id])
+        with self._lock:
+            by_product, by_category = dict(self._by_product), dict(self._by_category)
+            old_products, old_categories = self._links.get(promotion_id, ((), ()))
+            for product_id in old_products:
+                self._discard(by_product, product_id, promotion_id)
+            for category_id in old_categories:
+                self._discard(by_category, category_id, promotion_id)
+
+            all_links = dict(self._links)
+            all_links.pop(promotion_id, None)
+            if promotion_id in entries:
+                product_ids, category_ids = links[promotion_id]
+                for product_id in product_ids:
+                    self._add(by_product, product_id, entries[promotion_id])
+                for category_id in category_ids:
+                    self._add(by_category, category_id, entries[promotion_id])
+                all_links[promotion_id] = links[promotion_id]
+            self._by_product, self._by_category, self._links = by_product, by_category, all_links
+
+    def clear(self):
+        with self._lock:
+            self._by_product, self._by_category, self._links = {}, {}, {}
+            self._built_at = None
+
+    def _is_stale(self):
+        built_at = self._built_at
+        return built_at is None or time.monotonic() - built_at > self.ttl
+
+    def _ensure_fresh(self):
+        """
+        Rebuild a stale index on one thread at a time. Once built, other
+        threads keep serving the old snapshot instead of waiting; before the
+        first build they wait for it.
+        """
+        if not self._is_stale():
+            return
+        if not self._build_lock.acquire(blocking=self._built_at is None):
+            return
+        try:
+            if self._is_stale():
+                self.build()
+        finally:
+            self._build_lock.release()
+
+    def for_products(self, products, now):
+        """Live promotions for (product_id, category_id) pairs, keyed by product_id"""
+        self._ensure_fresh()
+        by_product, by_category = self._by_product, self._by_category
+        return {
+            product_id: [
+                entry for entry in by_product.get(product_id, ()) + by_category.get(category_id, ())
+                if entry.is_live(now)
+            ]
+            for product_id, category_id in products
+        }
+
+
+# Initialize global instance
+promotion_index = None
+
+def get_promotion_index():
+    """Get or create the process-wide promotion index"""
+    global promotion_index
+    if promotion_index is None:
+        promotion_index = PromotionIndex(ttl=int(os.getenv('PROMOTION_INDEX_TTL', '60')))
+    return promotion_index
@@ -0,0 +1,255 @@
+import os
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from werkzeug.utils import secure_filename
+from utils.image_urls import build_image_url
+
+# Size of the reads used to hash, copy and stream uploads
+CHUNK_SIZE = 1024 * 1024
+
+
+def measure_stream(stream):
+    """Read a stream once in chunks, returning its size, SHA-1 and SHA-256"""
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        sha1.update(chunk)
+        sha256.update(chunk)
+    stream.seek(0)
+    return size, sha1.hexdigest(), sha256.hexdigest()
+
+
+class StorageBackend:
+    """
+    Base class for object storage backends.
+
+    Subclasses implement _put(stream, file_path, content_type, size, sha1)
+    returning a backend file id, _get(file_path) returning the file's bytes,
+    and _delete(file_path), which succeeds when the file is already gone.
+    Naming, hashing, public URLs and concurrent uploads and deletes are shared.
+    """
+
+    name = 'base'
+
+    def get_file_url(self, file_path):
+        """Get public URL for a file"""
+        return build_image_url(file_path)
+
+    def generate_unique_filename(self, original_filename):
+        """Generate unique filename"""
+        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+        random_hash = hashlib.md5(f"{original_filename}{timestamp}".encode()).hexdigest()[:8]
+        name, ext = os.path.splitext(secure_filename(original_filename))
+        return f"{timestamp}_{random_hash}_{name}{ext}"
+
+    def upload_file(self, file, folder="products", file_name=None):
+        """Upload a werkzeug FileStorage, under file_name if given"""
+        try:
+            unique_filename = file_name or self.generate_unique_filename(file.filename)
+            file_path = f"{folder}/{unique_filename}"
+            content_type = file.content_type or mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+
+            # Hash in one chunked pass so the upload itself reads the stream once
+            stream = file.stream
+            size, sha1, sha256 = measure_stream(stream)
+            file_id = self._put(stream, file_path, content_type, size, sha1)
+
+            return {
+                'file_name': file_path,
+                'file_url': self.get_file_url(file_path),
+                'file_id': file_id,
+                'content_type': content_type,
+                'size': size,
+                'sha256': sha256
+            }
+        except Exception as e:
+            raise Exception(f"Failed to upload file: {str(e)}")
+
+    def upload_multiple_files(self, files, folder="products", max_workers=None, file_names=None):
+        """
+        Upload files concurrently on a bounded thread pool.
+
+        The returned 'results' list is aligned with `files` and holds the
+        upload_file result, or None for a file that failed. 'success' lists the
+        uploaded files in input order, each with its input 'index'.
+        `file_names`, if given, is aligned with `files`.
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv('UPLOAD_WORKERS', '4'))
+        if file_names is None:
+            file_names = [None] * len(files)
+        results = [None] * len(files)
+        errors = []
+
+        if files:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as pool:
+                futures = [
+                    pool.submit(self.upload_file, file, folder, file_name)
+                    for file, file_name in zip(files, file_names)
+                ]
+                for idx, future in enumerate(futures):
+                    try:
+                        results[idx] = future.result()
+                    except Exception as e:
+                        errors.append(f"Failed to upload {files[idx].filename}: {str(e)}")
+
+        success = [dict(result, index=idx) for idx, result in enumerate(results) if result is not None]
+        return {
+            'results': results,
+            'success': success,
+            'errors': errors,
+            'total': len(files),
+            'uploaded': len(success),
+            'failed': len(files) - len(success)
+        }
+
+    def read_file(self, file_name):
+        """Read a stored file into memory"""
+        return self._get(file_name)
+
+    def delete_file(self, file_name):
+        """Delete a stored file"""
+        try:
+            self._delete(file_name)
+            return True
+        except Exception as e:
+            print(f"Warning: Could not delete file {file_name}: {str(e)}")
+            return False
+
+    def delete_files(self, file_names, max_workers=None):
+        """
+        Delete files concurrently on a bounded thread pool.
+
+        Returns a dict mapping each file name to None when it was deleted (or
+        was already gone) or to the error message when the delete failed.
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv('UPLOAD_WORKERS', '4'))
+        outcomes = {}
+        if not file_names:
+            return outcomes
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(file_names)))) as pool:
+            futures = {file_name: pool.submit(self._delete, file_name) for file_name in file_names}
+            for file_name, future in futures.items():
+                try:
+                    future.result()
+                    outcomes[file_name] = None
+                except Exception as e:
+                    outcomes[file_name] = str(e) or type(e).__name__
+        return outcomes
+
+    def _put(self, stream, file_path, content_type, size, sha1):
+        raise NotImplementedError
+
+    def _get(self, file_path):
+        raise NotImplementedError
+
+    def _delete(self, file_path):
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """Stores files under a local directory, for development and benchmarks"""
+
+    name = 'local'
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.getenv('LOCAL_STORAGE_PATH', 'media'))
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, file_path):
+        path = os.path.abspath(os.path.join(self.root, file_path))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"Invalid file path {file_path}")
+        return path
+
+    def _put(self, stream, file_path, content_type, size, sha1):
+        path = self.path_for(file_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return file_path
+
+    def _get(self, file_path):
+        with open(self.path_for(file_path), 'rb') as f:
+            return f.read()
+
+    def _delete(self, file_path):
+        try:
+            os.remove(self.path_for(file_path))
+        except FileNotFoundError:
+            pass
+
+
+class InMemoryStorage(StorageBackend):
+    """Keeps files in a dict, for tests and offline load tests"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def _put(self, stream, file_path, content_type, size, sha1):
+        data = stream.read()
+        with self._lock:
+            self.files[file_path] = (data, content_type)
+        return file_path
+
+    def _get(self, file_path):
+        with self._lock:
+            return self.files[file_path][0]
+
+    def _delete(self, file_path):
+        with self._lock:
+            self.files.pop(file_path, None)
+
+
+# Initialize global instance
+storage = None
+_storage_lock = threading.Lock()
+
+def create_storage(backend=None):
+    """Create the storage backend named by STORAGE_BACKEND (b2, local or memory)"""
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'b2')).lower()
+    if backend == 'local':
+        return LocalStorage()
+    if backend == 'memory':
+        return InMemoryStorage()
+    if backend == 'b2':
+        # Imported here so the B2 SDK is only needed when B2 is used
+        from utils.b2_storage import B2Storage
+        return B2Storage()
+    raise ValueError(f"Unknown storage backend {backend}")
+
+def get_storage():
+    """Get or create the configured storage backend"""
+    global storage
+    if storage is None:
+        with _storage_lock:
+            if storage is None:
+                storage = create_storage()
+    return storage
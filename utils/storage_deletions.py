@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import insert, delete, update
+from extensions import db
+from models.storage_deletion import StorageDeletion
+from models.stored_image import StoredImage
+from models.image_derivative import ImageDerivative
+from utils.storage import get_storage
+from utils.background import start_periodic_worker
+
+# Rows claimed by a worker are hidden from other workers for this long; a
+# worker that dies mid-batch leaves its rows to be retried after the lease
+CLAIM_SECONDS = 300
+# Retry backoff doubles per attempt, up to MAX_BACKOFF_SECONDS
+BASE_BACKOFF_SECONDS = 30
+MAX_BACKOFF_SECONDS = 6 * 3600
+
+
+def enqueue_storage_deletions(file_names):
+    """
+    Record storage objects to delete, in the caller's transaction.
+
+    The rows commit or roll back with the database delete that orphaned the
+    objects, so a crash can neither lose a delete nor delete a file that is
+    still referenced. drain_storage_deletions() removes the objects later.
+    """
+    file_names = sorted({file_name for file_name in file_names if file_name})
+    if not file_names:
+        return
+    now = datetime.utcnow()
+    db.session.execute(
+        insert(StorageDeletion),
+        [
+            {'file_name': file_name, 'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+            for file_name in file_names
+        ]
+    )
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt once `attempts` attempts have failed"""
+    return timedelta(seconds=min(BASE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS))
+
+
+def _claim_batch(batch_size):
+    """Lease up to batch_size due rows and commit, returning (id, file_name, attempts)"""
+    now = datetime.utcnow()
+    rows = (
+        db.session.query(StorageDeletion.id, StorageDeletion.file_name, StorageDeletion.attempts)
+        .filter(StorageDeletion.next_attempt_at <= now)
+        .order_by(StorageDeletion.next_attempt_at, StorageDeletion.id)
+        .limit(batch_size)
+        # Concurrent workers (one per app process) skip each other's rows
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if rows:
+        db.session.execute(
+            update(StorageDeletion)
+            .where(StorageDeletion.id.in_([row.id for row in rows]))
+            .values(
+                attempts=StorageDeletion.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+            )
+        )
+    db.session.commit()
+    return rows
+
+
+def drain_storage_deletions(batch_size=None):
+    """
+    Delete one batch of pending storage objects.
+
+    Rows are leased in a short transaction so no lock is held while storage is
+    called, objects are deleted concurrently, then finished rows are removed in
+    one statement and failed rows rescheduled with exponential backoff.
+    Returns the number of rows processed.
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv('STORAGE_DELETION_BATCH', '100'))
+    rows = _claim_batch(batch_size)
+    if not rows:
+        return 0
+
+    # Upload names are unique (utils.image_store.content_file_name), so a queued
+    # object is never written again; this check keeps objects queued by
+    # mistake, and legacy names shared by content uploaded before that
+    file_names = {row.file_name for row in rows}
+    in_use = {
+        file_path for (file_path,) in
+        db.session.query(StoredImage.file_path).filter(StoredImage.file_path.in_(file_names))
+    }
+    in_use.update(
+        file_path for (file_path,) in
+        db.session.query(ImageDerivative.file_path).filter(ImageDerivative.file_path.in_(file_names))
+    )
+    # Release the connection while storage is called
+    db.session.close()
+
+    outcomes = get_storage().delete_files(sorted(file_names - in_use))
+
+    done = [row.id for row in rows if row.file_name in in_use or outcomes.get(row.file_name) is None]
+    failed = [row for row in rows if row.file_name not in in_use and outcomes.get(row.file_name) is not None]
+    if done:
+        db.session.execute(delete(StorageDeletion).where(StorageDeletion.id.in_(done)))
+    now = datetime.utcnow()
+    for row in failed:
+        print(f"Warning: Could not delete file {row.file_name}: {outcomes[row.file_name]}")
+        db.session.execute(
+            update(StorageDeletion)
+            .where(StorageDeletion.id == row.id)
+            .values(
+                last_error=outcomes[row.file_name][:1000],
+                next_attempt_at=now + retry_delay(row.attempts + 1)
+            )
+        )
+    db.session.commit()
+    return len(rows)
+
+
+def start_storage_deletion_worker(app, interval=None):
+    """Drain the deletion outbox on a background thread of this process"""
+    if interval is None:
+        interval = float(os.getenv('STORAGE_DELETION_INTERVAL', '10'))
+    return start_periodic_worker(app, 'storage-deletions', drain_storage_deletions, interval)